@@ -0,0 +1,165 @@
+"""
+Funções compartilhadas pelos scripts de análise (Streamlit e linha de comando):
+leitura dos ensaios, regressão e redução de pontos para gráficos.
+Não depende do Streamlit.
+"""
+import os
+import threading
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+# Colunas dos CSVs de ensaio da máquina (separador ";", vírgula decimal, 1 linha de cabeçalho)
+COLUNAS_ENSAIO = ["tempo_s", "deformacao_mm", "forca_n"]
+TIPOS_ENSAIO = dict.fromkeys(COLUNAS_ENSAIO, "float64")
+
+# Versão da leitura gravada no cache Parquet dos ensaios: incremente ao mudar ler_ensaio
+# ou o tratamento das linhas em carregar_ensaio, para não reaproveitar caches antigos
+VERSAO_CACHE_ENSAIO = 1
+
+
+# --- LEITURA DOS ENSAIOS ---
+
+def _ler_ensaio_pyarrow(origem, encoding):
+    """
+    Lê o CSV do ensaio com pyarrow.csv (vírgula decimal, colunas float64).
+    Retorna None se o pyarrow não estiver instalado ou se o arquivo não puder
+    ser lido assim (célula não numérica, colunas extras...).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+
+    try:
+        tabela = pa_csv.read_csv(
+            pa.BufferReader(origem) if isinstance(origem, bytes) else origem,
+            read_options=pa_csv.ReadOptions(column_names=COLUNAS_ENSAIO, skip_rows=1, encoding=encoding),
+            parse_options=pa_csv.ParseOptions(delimiter=";"),
+            convert_options=pa_csv.ConvertOptions(
+                decimal_point=",",
+                column_types=dict.fromkeys(COLUNAS_ENSAIO, pa.float64())
+            )
+        )
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        return None
+
+    return pd.DataFrame({
+        coluna: tabela.column(coluna).to_numpy(zero_copy_only=False)
+        for coluna in COLUNAS_ENSAIO
+    })
+
+def ler_ensaio(origem, usar_pyarrow=True, encoding="utf8"):
+    """
+    Lê o CSV de um ensaio (caminho ou conteúdo em bytes) com as colunas de
+    COLUNAS_ENSAIO: pyarrow, se usar_pyarrow e se estiver disponível; senão, o
+    parser C do pandas direto em float64. Se alguma célula não for numérica,
+    refaz a leitura convertendo coluna a coluna (valores inválidos viram NaN).
+    Nenhuma linha é descartada.
+    """
+    df_ensaio = _ler_ensaio_pyarrow(origem, encoding) if usar_pyarrow else None
+    if df_ensaio is not None:
+        return df_ensaio
+
+    def fonte():
+        return BytesIO(origem) if isinstance(origem, bytes) else origem
+
+    opcoes = dict(
+        sep=";", decimal=",", encoding=encoding, encoding_errors="ignore", engine="c",
+        header=0, names=COLUNAS_ENSAIO, usecols=[0, 1, 2]
+    )
+    try:
+        return pd.read_csv(fonte(), dtype=TIPOS_ENSAIO, **opcoes)
+    except ValueError:
+        df_ensaio = pd.read_csv(fonte(), **opcoes)
+        for coluna in COLUNAS_ENSAIO:
+            df_ensaio[coluna] = pd.to_numeric(df_ensaio[coluna], errors="coerce")
+        return df_ensaio
+
+def carregar_ensaio(caminho_csv, pasta_cache, usar_pyarrow=True):
+    """
+    Lê o ensaio (sem as linhas sem deformação ou força) do cache Parquet em
+    pasta_cache, se ele for mais novo que o CSV; senão, lê o CSV com ler_ensaio e
+    grava o cache. O nome do cache inclui VERSAO_CACHE_ENSAIO e o leitor, de modo
+    que scripts com leitores diferentes nunca reaproveitam a leitura um do outro.
+    O cache é opcional: qualquer falha nele cai na leitura do CSV.
+    """
+    nome = os.path.splitext(os.path.basename(caminho_csv))[0]
+    leitor = "pyarrow" if usar_pyarrow else "pandas"
+    caminho_cache = os.path.join(pasta_cache, f"{nome}.v{VERSAO_CACHE_ENSAIO}-{leitor}.parquet")
+
+    try:
+        if os.path.getmtime(caminho_cache) >= os.path.getmtime(caminho_csv):
+            return pd.read_parquet(caminho_cache)
+    except Exception:
+        pass  # sem cache (ou cache inválido): lê o CSV
+
+    df_ensaio = ler_ensaio(caminho_csv, usar_pyarrow).dropna(subset=["deformacao_mm", "forca_n"])
+    gravar_parquet(df_ensaio, caminho_cache)
+    return df_ensaio
+
+def gravar_parquet(df, caminho):
+    """
+    Grava df em Parquet (zstd) num arquivo temporário e o renomeia, para que quem
+    lê o cache (outro processo do Pool, outra sessão do Streamlit) nunca veja um
+    arquivo pela metade. Falhas são ignoradas: o cache em disco é opcional.
+    """
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        caminho_tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(caminho_tmp, compression="zstd")
+        os.replace(caminho_tmp, caminho)
+    except Exception:
+        pass
+
+
+# --- REGRESSÃO ---
+
+def regressao_linear(x, y):
+    """
+    Regressão linear por mínimos quadrados em forma fechada (somas centralizadas).
+    Retorna apenas (inclinação, intercepto, R²), sem o p-valor e o erro padrão
+    que o scipy.stats.linregress calcularia e que não são usados.
+    """
+    x_media, y_media = x.mean(), y.mean()
+    dx, dy = x - x_media, y - y_media
+    sxx, syy, sxy = dx @ dx, dy @ dy, dx @ dy
+    if sxx == 0:
+        raise ValueError("Todos os valores de x são idênticos.")
+    slope = sxy / sxx
+    intercept = y_media - slope * x_media
+    r_squared = sxy * sxy / (sxx * syy) if syy > 0 else 0.0
+    return slope, intercept, r_squared
+
+
+# --- REDUÇÃO DE PONTOS PARA GRÁFICOS ---
+
+# Número de pontos das curvas completas enviadas ao navegador
+PONTOS_LTTB = 2000
+
+def lttb(x, y, n_out=PONTOS_LTTB):
+    """
+    Largest-Triangle-Three-Buckets: devolve os índices de n_out pontos que preservam
+    a forma visual da curva (x, y). Os baldes são trechos consecutivos de índices,
+    na ordem em que a curva é percorrida: x não precisa ser crescente (carga e
+    descarga funcionam), mas x e y devem ser finitos. Os cálculos devem usar
+    sempre os dados completos.
+    """
+    n = x.size
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    limites = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        ini, fim = limites[i], limites[i + 1]
+        prox_fim = limites[i + 2] if i + 2 < n_out - 1 else n
+        mx, my = x[fim:prox_fim].mean(), y[fim:prox_fim].mean()
+        area = np.abs((x[a] - mx) * (y[ini:fim] - y[a]) - (x[a] - x[ini:fim]) * (my - y[a]))
+        a = ini + int(area.argmax())
+        idx[i + 1] = a
+    return idx
@@ -2,39 +2,126 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from io import StringIO
+from io import BytesIO
+import hashlib
 import os
 
+from comum import gravar_parquet
+
+# Cache em disco dos dados já limpos (sobrevive a reinícios do Streamlit).
+# Incremente VERSAO_CACHE ao mudar a leitura ou a limpeza em carregar_e_limpar_dados,
+# para não reaproveitar caches antigos; só os MAX_ARQUIVOS_CACHE arquivos usados
+# mais recentemente são mantidos
+PASTA_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "modulo_young")
+VERSAO_CACHE = 1
+MAX_ARQUIVOS_CACHE = 20
+
+# As curvas fora da faixa são desenhadas com no máximo MAX_PONTOS_FORA_FAIXA pontos
+# (amostragem a passo fixo, só quando há mais pontos que isso); a regressão usa
+# sempre todos os dados
+MAX_PONTOS_FORA_FAIXA = 3000
+
 # --- Funções de Carregamento e Pré-Processamento ---
+# Grandezas fixas do arquivo, calculadas uma única vez por arquivo:
+# extremos em df.attrs e a ordem das linhas por força crescente (para busca binária)
+def preparar_dados(df, chave):
+    df.attrs['chave'] = chave
+    desl = df[['Desl_LVDT_Abs', 'Desl_Pistao_Abs']].to_numpy()
+    df.attrs['Fmax'] = float(df['Forca_Abs'].max())
+    df.attrs['Dmin'] = float(desl.min())
+    df.attrs['Dmax'] = float(desl.max())
+
+    ordem_forca = np.argsort(df['Forca_Abs'].to_numpy(), kind='stable')
+    forca_ordenada = df['Forca_Abs'].to_numpy()[ordem_forca]
+    return df, ordem_forca, forca_ordenada
+
+def limpar_cache_disco():
+    # Apaga os arquivos do cache em disco além dos MAX_ARQUIVOS_CACHE usados mais
+    # recentemente (inclusive os de versões anteriores); falhas são ignoradas
+    try:
+        arquivos = [e for e in os.scandir(PASTA_CACHE) if e.name.endswith('.parquet')]
+        arquivos.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entrada in arquivos[MAX_ARQUIVOS_CACHE:]:
+            os.remove(entrada.path)
+    except OSError:
+        pass
+
 @st.cache_data
 def carregar_e_limpar_dados(uploaded_file, header_row=6):
     if uploaded_file is None:
         return None
+
+    conteudo = uploaded_file.getvalue()
+    chave = hashlib.sha256(conteudo + f"|{header_row}".encode()).hexdigest()
+    caminho_cache = os.path.join(PASTA_CACHE, f"{chave}.v{VERSAO_CACHE}.parquet")
+    if os.path.exists(caminho_cache):
+        try:
+            df = pd.read_parquet(caminho_cache)
+            os.utime(caminho_cache)  # marca como usado recentemente
+            return preparar_dados(df, chave)
+        except Exception:
+            pass  # cache corrompido: reprocessa o CSV
         
     try:
-        string_data = StringIO(uploaded_file.getvalue().decode("utf-8"))
-        df = pd.read_csv(string_data, sep=',', header=header_row, decimal='.') 
+        # Só as colunas de força e deslocamentos são usadas; as demais nem são convertidas
+        df = pd.read_csv(BytesIO(conteudo), sep=',', header=header_row, decimal='.',
+                         encoding='utf-8', usecols=[1, 2, 3])
     except Exception as e:
         st.error(f"Erro ao carregar o arquivo: {e}")
         return None
 
-    if len(df) > 0:
-        df = df.iloc[1:].copy()
-
-    df = df.apply(pd.to_numeric, errors='coerce')
-    df = df.dropna(subset=df.columns[[1, 2, 3]]).reset_index(drop=True)
-
-    df = df.rename(columns={
-        df.columns[1]: 'Forca_kN',
-        df.columns[2]: 'Desl_LVDT_mm',
-        df.columns[3]: 'Desl_Pistao_mm'
+    # A linha de unidades (logo abaixo do cabeçalho) é descartada na própria conversão
+    # numérica, sem copiar antes o DataFrame lido
+    df = pd.DataFrame({
+        'Forca_kN': pd.to_numeric(df.iloc[1:, 0], errors='coerce'),
+        'Desl_LVDT_mm': pd.to_numeric(df.iloc[1:, 1], errors='coerce'),
+        'Desl_Pistao_mm': pd.to_numeric(df.iloc[1:, 2], errors='coerce'),
     })
+    df = df.dropna().reset_index(drop=True)
+    # Leituras de sensor: float32 basta e reduz pela metade o tráfego de memória
+    df = df.astype(np.float32)
     
-    df['Forca_Abs'] = df['Forca_kN'] - df['Forca_kN'].iloc[0]
-    df['Desl_LVDT_Abs'] = abs(df['Desl_LVDT_mm'] - df['Desl_LVDT_mm'].iloc[0])
-    df['Desl_Pistao_Abs'] = abs(df['Desl_Pistao_mm'] - df['Desl_Pistao_mm'].iloc[0])
+    # Valores relativos à primeira leitura, calculados de uma vez para as três colunas
+    brutos = df[['Forca_kN', 'Desl_LVDT_mm', 'Desl_Pistao_mm']].to_numpy(dtype=np.float32)
+    relativos = brutos - brutos[0]
+    np.abs(relativos[:, 1:], out=relativos[:, 1:])
+    df['Forca_Abs'] = relativos[:, 0]
+    df['Desl_LVDT_Abs'] = relativos[:, 1]
+    df['Desl_Pistao_Abs'] = relativos[:, 2]
+
+    gravar_parquet(df, caminho_cache)
+    limpar_cache_disco()
+    return preparar_dados(df, chave)
+
+# --- Regressão Linear (mínimos quadrados, forma fechada) ---
+# Ajusta uma reta para cada coluna de X contra a mesma resposta y.
+# Todas as somas saem de um único produto matricial A.T @ A (BLAS), com A = [X | y]
+# em float64 para evitar cancelamento numérico.
+def ajuste_linear(X, y):
+    A = np.column_stack([X, y]).astype(np.float64, copy=False)
+    k = A.shape[1] - 1
+    n = A.shape[0]
+    somas = A.sum(axis=0)
+    G = A.T @ A
+    sx, sy = somas[:k], somas[k]
+    sxx, sxy = np.diagonal(G)[:k], G[:k, k]
+    slopes = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    intercepts = (sy - slopes * sx) / n
+    return slopes, intercepts
 
-    return df
+# Memoiza a regressão por (arquivo, limites): voltar o slider a uma posição já vista
+# não recalcula nada. Os arrays (prefixo "_") não entram no hash, pois são
+# determinados pela chave do arquivo e pelos limites.
+@st.cache_data(max_entries=256)
+def ajustar_faixa(chave_arquivo, F_limite_min, F_limite_max, D_limite_min, D_limite_max,
+                  _lvd_f, _pis_f, _forca_f):
+    (slope_lvd, slope_pis), (intercept_lvd, intercept_pis) = ajuste_linear(
+        np.column_stack([_lvd_f, _pis_f]), _forca_f
+    )
+    x_lvd = np.array([_lvd_f.min(), _lvd_f.max()])
+    x_pis = np.array([_pis_f.min(), _pis_f.max()])
+    return (slope_lvd, x_lvd, slope_lvd * x_lvd + intercept_lvd,
+            slope_pis, x_pis, slope_pis * x_pis + intercept_pis)
 
 # --- Interface Streamlit ---
 st.set_page_config(layout="wide")
@@ -53,22 +140,21 @@ uploaded_file_calibracao = st.file_uploader(
 )
 
 if uploaded_file_calibracao:
-    df_calibracao = carregar_e_limpar_dados(uploaded_file_calibracao)
+    dados_calibracao = carregar_e_limpar_dados(uploaded_file_calibracao)
     
-    if df_calibracao is not None:
+    if dados_calibracao is not None:
+        df_calibracao, ordem_forca, forca_ordenada = dados_calibracao
+
         # Nome do arquivo sem extensão
         nome_amostra = os.path.splitext(uploaded_file_calibracao.name)[0]
 
         # Cálculo dos limites de força
-        Forca_max_abs = df_calibracao['Forca_Abs'].max()
+        Forca_max_abs = df_calibracao.attrs['Fmax']
         F_limite_min = Forca_max_abs * F_min_pct
         F_limite_max = Forca_max_abs * F_max_pct
         
         # Slider de deslocamento
-        desl_min, desl_max = (
-            float(df_calibracao[['Desl_LVDT_Abs', 'Desl_Pistao_Abs']].min().min()),
-            float(df_calibracao[['Desl_LVDT_Abs', 'Desl_Pistao_Abs']].max().max())
-        )
+        desl_min, desl_max = df_calibracao.attrs['Dmin'], df_calibracao.attrs['Dmax']
         desl_range = st.sidebar.slider(
             "Selecione a faixa de deslocamento (mm)",
             desl_min, desl_max, (desl_min, desl_max), 0.01
@@ -81,82 +167,94 @@ if uploaded_file_calibracao:
                 f"**Faixa de Deslocamento:** {D_limite_min:.3f} – {D_limite_max:.3f} mm")
         
         # --- Filtragem: dentro dos limites ---
-        df_filtrado = df_calibracao[
-            (df_calibracao['Forca_Abs'] >= F_limite_min) &
-            (df_calibracao['Forca_Abs'] <= F_limite_max) &
-            (df_calibracao['Desl_LVDT_Abs'] >= D_limite_min) &
-            (df_calibracao['Desl_LVDT_Abs'] <= D_limite_max) &
-            (df_calibracao['Desl_Pistao_Abs'] >= D_limite_min) &
-            (df_calibracao['Desl_Pistao_Abs'] <= D_limite_max)
-        ]
+        # Faixa de força por busca binária; o deslocamento só é testado nas linhas candidatas
+        i_ini = np.searchsorted(forca_ordenada, F_limite_min, side='left')
+        i_fim = np.searchsorted(forca_ordenada, F_limite_max, side='right')
+        candidatos = ordem_forca[i_ini:i_fim]
+        lvd = df_calibracao['Desl_LVDT_Abs'].to_numpy()[candidatos]
+        pis = df_calibracao['Desl_Pistao_Abs'].to_numpy()[candidatos]
+        dentro = (
+            (lvd >= D_limite_min) & (lvd <= D_limite_max) &
+            (pis >= D_limite_min) & (pis <= D_limite_max)
+        )
+        mascara = np.zeros(len(df_calibracao), dtype=bool)
+        mascara[candidatos[dentro]] = True
+
+        # Pontos da faixa como arrays NumPy (a ordem por força não afeta a regressão)
+        forca_f = forca_ordenada[i_ini:i_fim][dentro]
+        lvd_f, pis_f = lvd[dentro], pis[dentro]
         
         # --- Gráfico ---
-        fig = go.Figure()
-        
-        df_out = df_calibracao[~df_calibracao.index.isin(df_filtrado.index)]
-        fig.add_trace(go.Scatter(
-            x=df_out['Desl_LVDT_Abs'], y=df_out['Forca_Abs'],
-            mode='lines', line=dict(color='blue', width=1, dash='dot'),
-            name='LVDT Fora da Faixa'
-        ))
-        fig.add_trace(go.Scatter(
-            x=df_out['Desl_Pistao_Abs'], y=df_out['Forca_Abs'],
-            mode='lines', line=dict(color='red', width=1, dash='dot'),
-            name='Pistão Fora da Faixa'
-        ))
-        fig.add_trace(go.Scatter(
-            x=df_filtrado['Desl_LVDT_Abs'], y=df_filtrado['Forca_Abs'],
-            mode='markers', marker=dict(color='blue', size=6),
-            name='LVDT (Faixa)'
-        ))
-        fig.add_trace(go.Scatter(
-            x=df_filtrado['Desl_Pistao_Abs'], y=df_filtrado['Forca_Abs'],
-            mode='markers', marker=dict(color='red', size=6),
-            name='Pistão (Faixa)'
-        ))
+        # Traços, formas e anotações são acumulados em listas e a figura é montada
+        # uma única vez no final; as nuvens de pontos usam WebGL (Scattergl)
+        # Fora da faixa: linhas fora da máscara, na ordem da leitura (mantém os trechos
+        # de carga e descarga), amostradas a passo fixo só se passarem do limite
+        linhas_fora = np.flatnonzero(~mascara)
+        passo_fora = max(1, int(np.ceil(linhas_fora.size / MAX_PONTOS_FORA_FAIXA)))
+        df_out = df_calibracao.iloc[linhas_fora[::passo_fora]]
+        tracos = [
+            go.Scattergl(
+                x=df_out['Desl_LVDT_Abs'], y=df_out['Forca_Abs'],
+                mode='lines', line=dict(color='blue', width=1, dash='dot'),
+                name='LVDT Fora da Faixa'
+            ),
+            go.Scattergl(
+                x=df_out['Desl_Pistao_Abs'], y=df_out['Forca_Abs'],
+                mode='lines', line=dict(color='red', width=1, dash='dot'),
+                name='Pistão Fora da Faixa'
+            ),
+            go.Scattergl(
+                x=lvd_f, y=forca_f,
+                mode='markers', marker=dict(color='blue', size=6),
+                name='LVDT (Faixa)'
+            ),
+            go.Scattergl(
+                x=pis_f, y=forca_f,
+                mode='markers', marker=dict(color='red', size=6),
+                name='Pistão (Faixa)'
+            ),
+        ]
+        formas, anotacoes = [], []
         
         # Linhas horizontais dos limites de força
         for pct, f_lim in zip([F_min_pct, F_max_pct], [F_limite_min, F_limite_max]):
-            fig.add_shape(type="line",
-                          x0=0, x1=desl_max*1.05,
-                          y0=f_lim, y1=f_lim,
-                          line=dict(color="green", width=4, dash="dot"))
-            fig.add_annotation(
+            formas.append(dict(type="line",
+                               x0=0, x1=desl_max*1.05,
+                               y0=f_lim, y1=f_lim,
+                               line=dict(color="green", width=4, dash="dot")))
+            anotacoes.append(dict(
                 x=0.5, y=f_lim,
                 text=f"{int(pct*100)}% da Fmáx",
                 showarrow=False, font=dict(color="green", size=12),
                 xanchor="left", yanchor="bottom"
-            )
+            ))
         
         # Linhas verticais dos limites de deslocamento
         for d_lim in [D_limite_min, D_limite_max]:
-            fig.add_shape(type="line",
-                          x0=d_lim, x1=d_lim,
-                          y0=0, y1=Forca_max_abs*1.05,
-                          line=dict(color="purple", width=3, dash="dot"))
-            fig.add_annotation(
+            formas.append(dict(type="line",
+                               x0=d_lim, x1=d_lim,
+                               y0=0, y1=Forca_max_abs*1.05,
+                               line=dict(color="purple", width=3, dash="dot")))
+            anotacoes.append(dict(
                 x=d_lim, y=Forca_max_abs*1.02,
                 text=f"{d_lim:.2f} mm",
                 showarrow=False, font=dict(color="purple", size=11),
                 xanchor="center"
-            )
+            ))
         
         # --- Regressão e Fator de Correção ---
         slope_lvd = slope_pis = np.nan
-        if len(df_filtrado) >= 2:
-            slope_lvd, intercept_lvd = np.polyfit(df_filtrado['Desl_LVDT_Abs'], df_filtrado['Forca_Abs'], 1)
-            slope_pis, intercept_pis = np.polyfit(df_filtrado['Desl_Pistao_Abs'], df_filtrado['Forca_Abs'], 1)
-            
-            # Retas de regressão
-            x_lvd = np.array([df_filtrado['Desl_LVDT_Abs'].min(), df_filtrado['Desl_LVDT_Abs'].max()])
-            y_lvd = slope_lvd * x_lvd + intercept_lvd
-            x_pis = np.array([df_filtrado['Desl_Pistao_Abs'].min(), df_filtrado['Desl_Pistao_Abs'].max()])
-            y_pis = slope_pis * x_pis + intercept_pis
-
-            fig.add_trace(go.Scatter(x=x_lvd, y=y_lvd, mode='lines',
+        if forca_f.size >= 2:
+            # Inclinações e retas de regressão (LVDT e Pistão compartilham a mesma força)
+            slope_lvd, x_lvd, y_lvd, slope_pis, x_pis, y_pis = ajustar_faixa(
+                df_calibracao.attrs['chave'], F_limite_min, F_limite_max, D_limite_min, D_limite_max,
+                lvd_f, pis_f, forca_f
+            )
+
+            tracos.append(go.Scatter(x=x_lvd, y=y_lvd, mode='lines',
                                      line=dict(color='yellow', width=3, dash='dash'),
                                      name=f'Regressão LVDT (slope={slope_lvd:.4f})'))
-            fig.add_trace(go.Scatter(x=x_pis, y=y_pis, mode='lines',
+            tracos.append(go.Scatter(x=x_pis, y=y_pis, mode='lines',
                                      line=dict(color='orange', width=3, dash='dash'),
                                      name=f'Regressão Pistão (slope={slope_pis:.4f})'))
 
@@ -174,13 +272,15 @@ if uploaded_file_calibracao:
             st.subheader("📋 Resultado consolidado")
             st.dataframe(df_resultado, use_container_width=True, hide_index=True)
 
-        fig.update_layout(
+        fig = go.Figure(data=tracos, layout=dict(
             title="Carga vs Deslocamento com Filtros, Regressão e Fator de Correção",
             xaxis_title="Deslocamento Absoluto (mm)",
             yaxis_title="Força (kN)",
             legend_title="Sensor",
             template="simple_white",
-            height=600
-        )
+            height=600,
+            shapes=formas,
+            annotations=anotacoes
+        ))
         
         st.plotly_chart(fig, use_container_width=True)
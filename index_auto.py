@@ -1,8 +1,12 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
+import csv
 import os
+import re
 import sys
+from multiprocessing import Pool
+
+from comum import regressao_linear, carregar_ensaio
 
 # --- CONSTANTES GLOBAIS ---
 MEGA_TO_SI = 1e6   # 1 MPa = 10^6 Pa
@@ -16,74 +20,126 @@ PERCENTUAL_MAX_MODULO = 0.40
 MIN_R2_WINDOW_POINTS = 1500 # Novo: Mínimo de 1500 pontos
 R2_WINDOW_SIZES = [1500, 2000, 3000, 4000] # Novo: Testar tamanhos comuns de janelas
 R2_STEP_SIZE = 50           # Deslocamento da janela (aumentado para otimizar o tempo)
+R2_EARLY_EXIT = None        # Encerra a busca quando o melhor R² atinge este valor (None = busca completa, padrão)
+R2_FLOAT32_MIN_PONTOS = 100_000 # A partir deste tamanho, a janela é escolhida em float32 (o ajuste publicado é em float64)
 
 # Configurações de Arquivos
 PASTA_ENSAIOS = "ensaios" 
+PASTA_CACHE_ENSAIOS = os.path.join(PASTA_ENSAIOS, ".cache") # Ensaios já lidos, em Parquet
 ARQUIVO_GERAL = "geral.csv"
 ARQUIVO_SAIDA = "resultados_norma_e_otimizado_v2.csv"
+CAMPOS_SAIDA = [
+    "CP", "Tensão_Máxima [Pa]",
+    "E_Norma [Pa]", "R2_Norma", "Intercepto_Norma [Pa]",
+    "Limite_Inf_Norma [Pa]", "Limite_Sup_Norma [Pa]", "Pontos_Norma",
+    "E_Otimizado [Pa]", "R2_Otimizado", "Intercepto_Otimizado [Pa]",
+    "Pontos_Otimizado", "Start_Idx_Otimizado", "End_Idx_Otimizado",
+]
 COLUNAS_GERAL = [
     "cp", "nome", "largura", "espessura", 
     "ret_ext", "area", "forca_max", "tensao_max", "energia"
 ]
+PADRAO_NUM_CP = re.compile(r"\d+") # Número do CP dentro do nome (ex.: "CP 12" -> 12)
+
+# Leitor de CSV dos ensaios: "pandas" (padrão) ou "pyarrow" (parser multithread).
+# Ex.: MODULO_YOUNG_LEITOR_CSV=pyarrow python index_auto.py
+LEITOR_CSV = os.environ.get("MODULO_YOUNG_LEITOR_CSV", "pandas").strip().lower()
 
 # --- FUNÇÕES DE CÁLCULO ---
 
-def hunting_E_best_R2(df_ensaio, max_sigma_index):
+def buscar_janelas_r2(x, y, window_sizes, step, r2_parada=None):
+    """
+    Núcleo da busca do melhor R², sobre arrays NumPy float64 (sem pandas).
+
+    Todas as janelas de um mesmo tamanho são avaliadas de uma vez a partir de
+    somas acumuladas (prefixos) de x, y, x², y² e xy: cada janela custa O(1).
+    Se r2_parada for dado, os tamanhos seguintes são ignorados assim que o melhor
+    R² o atingir; o resultado pode então diferir da busca completa (janelas
+    ainda não testadas podem ter R² maior), por isso o padrão é não parar.
+    Retorna (E, R², intercepto, início, fim, tamanho), com início/fim posicionais.
+    """
+    best = (np.nan, -1.0, np.nan, -1, -1, 0)
+    n_points = x.size
+
+    # Somas acumuladas (com zero inicial) dos dados centralizados na média,
+    # o que reduz o cancelamento numérico nas diferenças entre prefixos.
+    # x e y podem vir em float32: a centralização e os produtos ficam no tipo
+    # de entrada, mas médias e somas acumuladas são sempre float64
+    x_media, y_media = x.mean(dtype=np.float64), y.mean(dtype=np.float64)
+    xc, yc = x - x.dtype.type(x_media), y - y.dtype.type(y_media)
+
+    def prefixo(v):
+        return np.concatenate(([0.0], np.cumsum(v, dtype=np.float64)))
+
+    cx, cy = prefixo(xc), prefixo(yc)
+    cxx, cyy, cxy = prefixo(xc * xc), prefixo(yc * yc), prefixo(xc * yc)
+
+    for w in window_sizes:
+        
+        if w > n_points:
+            continue # O tamanho da janela é maior que os dados disponíveis
+
+        # Todas as posições da janela deslizante de uma só vez
+        inicios = np.arange(0, n_points - w + 1, step)
+        fins = inicios + w
+
+        Sx, Sy = cx[fins] - cx[inicios], cy[fins] - cy[inicios]
+        Sxx, Syy, Sxy = cxx[fins] - cxx[inicios], cyy[fins] - cyy[inicios], cxy[fins] - cxy[inicios]
+
+        var_x = w * Sxx - Sx * Sx
+        var_y = w * Syy - Sy * Sy
+        cov_xy = w * Sxy - Sx * Sy
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_squared = cov_xy * cov_xy / (var_x * var_y)
+        # Janelas degeneradas (variância nula) valem R² = 0
+        r_squared = np.where(np.isfinite(r_squared), r_squared, 0.0)
+
+        k = int(np.argmax(r_squared))
+
+        # Se o R² for o melhor já encontrado em qualquer tamanho de janela, atualiza
+        if r_squared[k] > best[1]:
+            slope = cov_xy[k] / var_x[k]
+            # Intercepto de volta às coordenadas originais (não centralizadas)
+            intercept = (Sy[k] - slope * Sx[k]) / w + y_media - slope * x_media
+            best = (slope, float(r_squared[k]), intercept, int(inicios[k]), int(fins[k] - 1), w)
+
+        # Ajuste praticamente perfeito: os demais tamanhos não melhoram o resultado
+        if r2_parada is not None and best[1] >= r2_parada:
+            break
+
+    return best
+
+def hunting_E_best_R2(deformacao, tensao, max_sigma_index):
     """
     Procura o segmento de reta com o maior R² (melhor ajuste) 
     testando múltiplos tamanhos de janela na região elástica (0 a sigma_max).
+    Recebe os vetores (float64) de deformação específica e tensão (Pa) do ensaio.
     """
-    best_r2_global = -1.0
-    best_E_global = np.nan
-    best_intercept_global = np.nan
-    best_start_idx_global = -1
-    best_end_idx_global = -1
-    best_window_size_global = 0
-
     # 1. Definir o range de busca e verificar o mínimo de dados
-    df_search = df_ensaio.iloc[:max_sigma_index].reset_index(drop=True)
-    n_points = len(df_search)
+    n_points = max_sigma_index
     
     if n_points < MIN_R2_WINDOW_POINTS:
         return np.nan, np.nan, np.nan, np.nan, np.nan, np.nan
 
-    # 2. Iterar sobre todos os tamanhos de janela predefinidos
-    for window_size in R2_WINDOW_SIZES:
-        
-        if window_size > n_points:
-            continue # O tamanho da janela é maior que os dados disponíveis
+    x, y = deformacao[:n_points], tensao[:n_points]
 
-        # 3. Iteração da Janela Deslizante
-        for i in range(0, n_points - window_size + 1, R2_STEP_SIZE):
-            
-            start_idx = i
-            end_idx = i + window_size
-            
-            df_window = df_search.iloc[start_idx:end_idx]
-            
-            try:
-                # Realiza a regressão
-                slope, intercept, r_value, p_value, std_err = stats.linregress(
-                    df_window["deformacao_especifica"], df_window["tensao_pa"]
-                )
-                r_squared = r_value**2
-                
-                # Se o R² for o melhor já encontrado em qualquer tamanho de janela, atualiza
-                if r_squared > best_r2_global:
-                    best_r2_global = r_squared
-                    best_E_global = slope
-                    best_intercept_global = intercept
-                    # Usamos os índices originais do DataFrame de ensaio
-                    best_start_idx_global = df_ensaio.index[start_idx] 
-                    best_end_idx_global = df_ensaio.index[end_idx - 1] 
-                    best_window_size_global = window_size
-                    
-            except ValueError:
-                # Caso a regressão falhe, apenas ignora
-                continue
-            
-    return (best_E_global, best_r2_global, best_intercept_global, 
-            best_start_idx_global, best_end_idx_global, best_window_size_global)
+    # 2. Busca sobre os arrays crus (os índices retornados já são os do ensaio)
+    if n_points < R2_FLOAT32_MIN_PONTOS:
+        return buscar_janelas_r2(x, y, R2_WINDOW_SIZES, R2_STEP_SIZE, R2_EARLY_EXIT)
+
+    # Ensaios longos: a varredura em float32 (metade do tráfego de memória) só
+    # escolhe a janela; E, intercepto e R² publicados são recalculados em float64
+    # sobre a fatia vencedora, como na busca em float64
+    melhor = buscar_janelas_r2(
+        x.astype(np.float32), y.astype(np.float32), R2_WINDOW_SIZES, R2_STEP_SIZE, R2_EARLY_EXIT
+    )
+    _, _, _, start_idx, end_idx, window_size = melhor
+    try:
+        slope, intercept, r_squared = regressao_linear(x[start_idx:end_idx + 1], y[start_idx:end_idx + 1])
+    except ValueError:
+        return melhor # Janela degenerada (x constante): mantém o resultado da varredura
+    return slope, r_squared, intercept, start_idx, end_idx, window_size
 
 def processar_cp(cp_nome, area_mm2):
     """
@@ -98,11 +154,7 @@ def processar_cp(cp_nome, area_mm2):
 
     try:
         # 1. Carregar Dados do Ensaio
-        df_ensaio = pd.read_csv(caminho_csv, sep=";", decimal=",", encoding_errors="ignore")
-        df_ensaio.columns = ["tempo_s", "deformacao_mm", "forca_n"]
-        df_ensaio["deformacao_mm"] = pd.to_numeric(df_ensaio["deformacao_mm"], errors="coerce")
-        df_ensaio["forca_n"] = pd.to_numeric(df_ensaio["forca_n"], errors="coerce")
-        df_ensaio = df_ensaio.dropna(subset=["deformacao_mm", "forca_n"]).reset_index(drop=True)
+        df_ensaio = carregar_ensaio(caminho_csv, PASTA_CACHE_ENSAIOS, usar_pyarrow=(LEITOR_CSV == "pyarrow"))
 
     except Exception:
         #print(f"❌ Erro ao ler ou processar o arquivo {caminho_csv}: {e}")
@@ -111,37 +163,41 @@ def processar_cp(cp_nome, area_mm2):
     if df_ensaio.empty:
         return None
 
+    # Daqui em diante só as colunas numéricas são usadas: vetores NumPy float64
+    # contíguos (sem cópia quando a coluna já está assim); as janelas e a busca
+    # trabalham sobre fatias (views) desses vetores
+    deformacao_mm = np.ascontiguousarray(df_ensaio["deformacao_mm"].to_numpy(), dtype=np.float64)
+    forca_n = np.ascontiguousarray(df_ensaio["forca_n"].to_numpy(), dtype=np.float64)
+
     # 2. Cálculos de Tensão (Pa) e Deformação Específica
-    df_ensaio["tensao_pa"] = (df_ensaio["forca_n"] / area_mm2) * MEGA_TO_SI 
-    df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM 
+    tensao_pa = (forca_n / area_mm2) * MEGA_TO_SI 
+    deformacao_especifica = -deformacao_mm / L0_MM 
     
-    tensao_max_pa = df_ensaio["tensao_pa"].max()
+    # Encontra o índice da tensão máxima
+    max_sigma_index = int(np.argmax(tensao_pa))
+    tensao_max_pa = tensao_pa[max_sigma_index]
 
     if tensao_max_pa <= 0:
         return None
-        
-    # Encontra o índice da tensão máxima
-    max_sigma_index = df_ensaio["tensao_pa"].idxmax()
     
     # --- RESULTADOS DA NORMA (10% - 40%) ---
     sigma_inferior_norma = PERCENTUAL_MIN_MODULO * tensao_max_pa
     sigma_superior_norma = PERCENTUAL_MAX_MODULO * tensao_max_pa
     
-    df_norma = df_ensaio[
-        (df_ensaio["tensao_pa"] >= sigma_inferior_norma) & 
-        (df_ensaio["tensao_pa"] <= sigma_superior_norma)
-    ].copy()
+    mascara_norma = (tensao_pa >= sigma_inferior_norma) & (tensao_pa <= sigma_superior_norma)
+    pontos_norma = int(np.count_nonzero(mascara_norma))
     
     E_norma, R2_norma, Intercept_norma = np.nan, np.nan, np.nan
-    if len(df_norma) >= MIN_R2_WINDOW_POINTS: # Aumentando a segurança também para a norma
+    if pontos_norma >= MIN_R2_WINDOW_POINTS: # Aumentando a segurança também para a norma
         try:
-            slope, intercept, r_value, _, _ = stats.linregress(df_norma["deformacao_especifica"], df_norma["tensao_pa"])
-            E_norma, R2_norma, Intercept_norma = slope, r_value**2, intercept
+            E_norma, Intercept_norma, R2_norma = regressao_linear(
+                deformacao_especifica[mascara_norma], tensao_pa[mascara_norma]
+            )
         except ValueError:
             pass
     
     # --- RESULTADOS OTIMIZADOS (R² HUNTING) ---
-    (E_otimizado, R2_otimizado, Intercept_otimizado, Start_Idx_Otimizado, End_Idx_Otimizado, Window_Size_Otimizado) = hunting_E_best_R2(df_ensaio, max_sigma_index)
+    (E_otimizado, R2_otimizado, Intercept_otimizado, Start_Idx_Otimizado, End_Idx_Otimizado, Window_Size_Otimizado) = hunting_E_best_R2(deformacao_especifica, tensao_pa, max_sigma_index)
 
     # 3. Retorno dos Resultados
     return {
@@ -153,7 +209,7 @@ def processar_cp(cp_nome, area_mm2):
         "Intercepto_Norma [Pa]": Intercept_norma,
         "Limite_Inf_Norma [Pa]": sigma_inferior_norma,
         "Limite_Sup_Norma [Pa]": sigma_superior_norma,
-        "Pontos_Norma": len(df_norma) if not df_norma.empty else 0,
+        "Pontos_Norma": pontos_norma,
 
         "E_Otimizado [Pa]": E_otimizado,
         "R2_Otimizado": R2_otimizado,
@@ -165,6 +221,35 @@ def processar_cp(cp_nome, area_mm2):
 
 # --- EXECUÇÃO DO BATCH ---
 
+def numero_cp(nome_cp):
+    # Primeiro número do nome do CP (NaN se não houver) para ordenar os CPs
+    encontrado = PADRAO_NUM_CP.search(str(nome_cp))
+    return int(encontrado.group()) if encontrado else np.nan
+
+def _processar_cp_tarefa(tarefa):
+    # Adaptador de nível de módulo (serializável) para o Pool
+    return processar_cp(*tarefa)
+
+def formatar_resultado(resultado, colunas_float):
+    """
+    Linha do CSV de saída no formato do DataFrame.to_csv(float_format="%.5e"):
+    as colunas em colunas_float (as que têm algum valor float em qualquer linha,
+    como o pandas faria com a coluna inteira) em notação científica com 5 casas,
+    NaN vazio; as demais (inteiras) como estão.
+    """
+    return {
+        campo: ("" if np.isnan(valor) else f"{valor:.5e}") if campo in colunas_float else valor
+        for campo, valor in resultado.items()
+    }
+
+def gravar_resultados(resultados, colunas_float):
+    """Grava de uma vez o CSV de saída com todas as linhas já processadas."""
+    with open(ARQUIVO_SAIDA, "w", newline="", encoding="latin-1") as arquivo:
+        escritor = csv.DictWriter(arquivo, fieldnames=CAMPOS_SAIDA, delimiter=";", lineterminator=os.linesep)
+        escritor.writeheader()
+        escritor.writerows(formatar_resultado(r, colunas_float) for r in resultados)
+
+
 def main():
     print(f"Iniciando processamento em lote (v2) com R² Hunting (Janelas: {R2_WINDOW_SIZES})...")
 
@@ -181,7 +266,8 @@ def main():
             encoding_errors="ignore",
             header=None,       
             skiprows=1, 
-            names=COLUNAS_GERAL 
+            names=COLUNAS_GERAL,
+            dtype={"cp": str, "nome": str}
         )
         geral["area"] = pd.to_numeric(geral["area"], errors='coerce')
     except Exception as e:
@@ -195,44 +281,60 @@ def main():
         print("❌ Nenhum Corpo de Prova com área válida encontrado no geral.csv.")
         sys.exit(1)
 
-    cp_validos["cp_num"] = cp_validos["cp"].str.extract(r"(\d+)").astype(int, errors='ignore')
+    cp_validos["cp_num"] = [numero_cp(nome) for nome in cp_validos["cp"].to_numpy()]
     cp_validos = cp_validos.sort_values(by="cp_num").reset_index(drop=True)
     
     print(f"Total de CPs válidos a processar: {len(cp_validos)}")
     
-    # 3. Processar em Loop
-    resultados_list = []
+    # 3. Processar em paralelo (cada CP é independente dos demais)
+    #    imap preserva a ordem dos CPs e entrega os resultados à medida que ficam prontos
+    tarefas = list(zip(cp_validos["cp"].to_numpy(), cp_validos["area"].to_numpy(dtype=np.float64)))
+    resultados = []
+    colunas_float = set()
+    regravar = False
+    arquivo_saida = None
     
-    for index, row in cp_validos.iterrows():
-        cp_nome = row["cp"]
-        area = row["area"]
-        
-        sys.stdout.write(f"\r-> Processando {cp_nome} ({index + 1}/{len(cp_validos)})...")
-        sys.stdout.flush()
-        
-        resultado = processar_cp(cp_nome, area)
-        
-        if resultado:
-            resultados_list.append(resultado)
+    # 4. Exportar cada resultado assim que fica pronto (o arquivo só é criado
+    #    no primeiro CP processado com sucesso)
+    #    Formato do CSV: ponto como decimal, notação científica com 5 casas; NaN vazio.
+    #    Como no DataFrame.to_csv, uma coluna inteira com algum NaN (ex.: a janela
+    #    otimizada de um CP curto) sai inteira em notação científica: se isso só
+    #    aparece depois de linhas já gravadas, o arquivo é regravado no final
+    try:
+        with Pool(processes=os.cpu_count()) as pool:
+            for index, resultado in enumerate(pool.imap(_processar_cp_tarefa, tarefas, chunksize=4)):
+                sys.stdout.write(f"\r-> Processados {index + 1}/{len(tarefas)} CPs...")
+                sys.stdout.flush()
+                
+                if not resultado:
+                    continue
+
+                if arquivo_saida is None:
+                    arquivo_saida = open(ARQUIVO_SAIDA, "w", newline="", encoding="latin-1")
+                    escritor = csv.DictWriter(
+                        arquivo_saida, fieldnames=CAMPOS_SAIDA, delimiter=";", lineterminator=os.linesep
+                    )
+                    escritor.writeheader()
+
+                novas_float = {campo for campo, valor in resultado.items() if isinstance(valor, float)} - colunas_float
+                regravar = regravar or (bool(novas_float) and bool(resultados))
+                colunas_float |= novas_float
 
-    # 4. Consolidar e Exportar
-    if not resultados_list:
+                escritor.writerow(formatar_resultado(resultado, colunas_float))
+                arquivo_saida.flush()
+                resultados.append(resultado)
+    finally:
+        if arquivo_saida is not None:
+            arquivo_saida.close()
+
+    if not resultados:
         print("\nProcessamento concluído. 😔 Nenhum CP foi processado com sucesso.")
         return
 
-    df_final = pd.DataFrame(resultados_list)
-    
-    # Formato do CSV (ponto como decimal, notação científica com 5 casas)
-    df_final.to_csv(
-        ARQUIVO_SAIDA, 
-        sep=';', 
-        decimal='.', 
-        index=False, 
-        encoding='latin-1',
-        float_format='%.5e'
-    )
+    if regravar:
+        gravar_resultados(resultados, colunas_float)
     
-    print(f"\n✅ Sucesso! {len(df_final)} CPs processados.")
+    print(f"\n✅ Sucesso! {len(resultados)} CPs processados.")
     print(f"Arquivo de resultados salvo em: {ARQUIVO_SAIDA}")
 
 if __name__ == "__main__":
@@ -3,8 +3,12 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import re
+import csv
+import io
 import numpy as np
-from scipy import stats
+
+from comum import regressao_linear, ler_ensaio
 
 # Constantes de conversão
 MEGA_TO_SI = 1e6 # 1 MPa = 10^6 Pa
@@ -28,20 +32,30 @@ COLUNAS_GERAL = [
     "cp", "nome", "largura", "espessura", 
     "ret_ext", "area", "forca_max", "tensao_max", "energia"
 ]
+PADRAO_NUM_CP = re.compile(r"\d+") # Número do CP dentro do nome (ex.: "CP 12" -> "12")
+MAX_OPCOES_SLIDER = 500 # Máximo de posições em cada select_slider (resolução visual)
+MAX_PONTOS_GRAFICO = 5000 # Máximo de pontos das curvas completas nos gráficos
 
 # ------------------------------------------------------------
-# CARREGAR ARQUIVO GERAL (Para obter as dimensões)
+# FUNÇÕES DE CARREGAMENTO (em cache; a data de modificação do arquivo entra na
+# chave, de modo que editar o CSV invalida o cache)
 # ------------------------------------------------------------
-try:
-    # Assumindo que o arquivo geral.csv contém a lista de CPs e suas dimensões.
+def numero_cp(nome_cp):
+    # Primeiro número do nome do CP, como texto ("nan" se não houver)
+    encontrado = PADRAO_NUM_CP.search(str(nome_cp))
+    return encontrado.group() if encontrado else "nan"
+
+@st.cache_data(show_spinner=False)
+def carregar_geral(caminho, mtime):
     geral = pd.read_csv(
-        "geral.csv", 
+        caminho, 
         sep=";", 
         decimal=",", 
         encoding_errors="ignore",
         header=None,       
         skiprows=1,        
-        names=COLUNAS_GERAL 
+        names=COLUNAS_GERAL,
+        dtype={"cp": str, "nome": str}
     )
     
     # GARANTINDO O TIPO NUMÉRICO (Correção para o TypeError)
@@ -50,7 +64,103 @@ try:
     geral["espessura"] = pd.to_numeric(geral["espessura"], errors='coerce')
     
     # Extrai o número do CP para auxiliar na filtragem/ordenacao
-    geral["cp_num"] = geral["cp"].str.extract(r"(\d+)").astype(str)
+    geral["cp_num"] = [numero_cp(nome) for nome in geral["cp"].to_numpy()]
+    return geral
+
+@st.cache_data(show_spinner=False)
+def carregar_ensaio_pagina(caminho, mtime):
+    # Parser C direto em float64 (inválidos viram NaN), sem o pyarrow; cache só em
+    # memória, por (caminho, mtime) — não usa o cache Parquet de comum.carregar_ensaio
+    df_ensaio = ler_ensaio(caminho, usar_pyarrow=False)
+    return df_ensaio.dropna(subset=["tempo_s", "deformacao_mm", "forca_n"]).sort_values(by="tempo_s").reset_index(drop=True)
+
+# O DataFrame (prefixo "_") não entra no hash: ele é determinado por (caminho, mtime)
+@st.cache_data(show_spinner=False)
+def calcular_tensao_deformacao(_df_ensaio, caminho, mtime, area):
+    df_ensaio = _df_ensaio.copy()
+    # Tensão (N/mm²) * 10^6 = Pa. (F/A em N/mm² é o mesmo que MPa)
+    df_ensaio["tensao_pa"] = (df_ensaio["forca_n"] / area) * MEGA_TO_SI 
+    # Deformação Específica (mm/mm é adimensional, usamos L0 em mm)
+    df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM 
+    return df_ensaio
+
+def opcoes_slider(valores, max_opcoes=MAX_OPCOES_SLIDER):
+    """
+    Recebe os valores únicos e ordenados de um slider e retorna (opções, padrão),
+    em que padrão = (mínimo, máximo) fica em 10% e 90% da lista completa.
+    Acima de max_opcoes valores, as opções são amostradas uniformemente (em
+    posição), mantendo os extremos e os dois valores padrão.
+    """
+    i_min, i_max = 0, valores.size - 1
+    if valores.size > 10:
+        i_min, i_max = int(valores.size * 0.10), int(valores.size * 0.90)
+    padrao = (valores[i_min], valores[i_max])
+
+    if valores.size > max_opcoes:
+        indices = np.linspace(0, valores.size - 1, max_opcoes - 2).astype(np.int64)
+        valores = valores[np.union1d(indices, [i_min, i_max])]
+    return valores, padrao
+
+# Opções (únicas e ordenadas) dos sliders de deformação e tensão, uma vez por CP.
+# O filtro continua sendo aplicado sobre os dados completos; só os pontos de
+# parada dos sliders são reduzidos.
+@st.cache_data(show_spinner=False)
+def valores_sliders(_df_ensaio, caminho, mtime, area):
+    valores_eps = np.unique(np.round(_df_ensaio["deformacao_especifica"].to_numpy(), 6))
+    valores_tensao_pa = np.unique(np.round(_df_ensaio["tensao_pa"].to_numpy(), 0))
+    return opcoes_slider(valores_eps), opcoes_slider(valores_tensao_pa)
+
+# Ordenação (estável) dos pontos pela deformação, calculada uma vez por CP
+@st.cache_data(show_spinner=False)
+def ordenar_por_deformacao(_df_ensaio, caminho, mtime, area):
+    eps = _df_ensaio["deformacao_especifica"].to_numpy()
+    ordem = np.argsort(eps, kind="stable")
+    return ordem, eps[ordem]
+
+# Filtro retangular (ε, σ) + regressão, em cache pelos limites dos sliders.
+# Retorna os índices (posicionais) dos pontos filtrados, E, intercepto, R² e se houve erro.
+@st.cache_data(show_spinner=False)
+def filtrar_e_ajustar(_df_ensaio, caminho, mtime, area, eps_min, eps_max, tensao_min, tensao_max):
+    eps = _df_ensaio["deformacao_especifica"].to_numpy()
+    sigma = _df_ensaio["tensao_pa"].to_numpy()
+
+    # Faixa de ε por busca binária no vetor ordenado; a condição em σ só é
+    # testada nos candidatos dessa faixa
+    ordem, eps_ordenado = ordenar_por_deformacao(_df_ensaio, caminho, mtime, area)
+    inicio = np.searchsorted(eps_ordenado, eps_min, side="left")
+    fim = np.searchsorted(eps_ordenado, eps_max, side="right")
+    candidatos = ordem[inicio:fim]
+    sigma_candidatos = sigma[candidatos]
+    indices = np.sort(candidatos[(sigma_candidatos >= tensao_min) & (sigma_candidatos <= tensao_max)])
+
+    E_modulo, intercept, r_squared, erro = np.nan, np.nan, np.nan, False
+    if indices.size > 1:
+        try:
+            # A regressão usa Deformação (adimensional) e Tensão (Pa) -> E_modulo sai em Pa
+            E_modulo, intercept, r_squared = regressao_linear(eps[indices], sigma[indices])
+        except ValueError:
+            erro = True
+    return indices, E_modulo, intercept, r_squared, erro
+
+# CSV completo do ensaio (bytes latin-1, vírgula decimal), montado uma vez por CP
+# com csv.writer; repr() dá os mesmos números que o DataFrame.to_csv
+COLUNAS_EXPORTACAO = ["tempo_s", "deformacao_mm", "forca_n", "tensao_pa", "deformacao_especifica"]
+
+@st.cache_data(show_spinner=False)
+def gerar_csv_completo(_df_ensaio, caminho, mtime, area):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";", lineterminator=os.linesep)
+    escritor.writerow(COLUNAS_EXPORTACAO)
+    linhas = _df_ensaio[COLUNAS_EXPORTACAO].to_numpy(dtype=np.float64).tolist()
+    escritor.writerows([repr(valor).replace(".", ",") for valor in linha] for linha in linhas)
+    return buffer.getvalue().encode("latin-1")
+
+# ------------------------------------------------------------
+# CARREGAR ARQUIVO GERAL (Para obter as dimensões)
+# ------------------------------------------------------------
+try:
+    # Assumindo que o arquivo geral.csv contém a lista de CPs e suas dimensões.
+    geral = carregar_geral("geral.csv", os.path.getmtime("geral.csv"))
 except FileNotFoundError:
     st.error("❌ Arquivo 'geral.csv' não encontrado no diretório do projeto.")
     st.stop()
@@ -104,12 +214,8 @@ if not os.path.exists(caminho_csv):
     st.stop()
 
 try:
-    df_ensaio = pd.read_csv(caminho_csv, sep=";", decimal=",", encoding_errors="ignore")
-    df_ensaio.columns = ["tempo_s", "deformacao_mm", "forca_n"]
-    df_ensaio["tempo_s"] = pd.to_numeric(df_ensaio["tempo_s"], errors="coerce")
-    df_ensaio["deformacao_mm"] = pd.to_numeric(df_ensaio["deformacao_mm"], errors="coerce")
-    df_ensaio["forca_n"] = pd.to_numeric(df_ensaio["forca_n"], errors="coerce")
-    df_ensaio = df_ensaio.dropna(subset=["tempo_s", "deformacao_mm", "forca_n"]).sort_values(by="tempo_s").reset_index(drop=True)
+    mtime_ensaio = os.path.getmtime(caminho_csv)
+    df_ensaio = carregar_ensaio_pagina(caminho_csv, mtime_ensaio)
     
 except Exception as e:
     st.error(f"Erro ao ler ou processar o arquivo {caminho_csv}: {e}")
@@ -126,10 +232,7 @@ if area <= 0 or pd.isna(area):
       st.error(f"❌ Área do CP {cp_selecionado} inválida ou zero ({area} mm²).")
       st.stop()
 
-# Tensão (N/mm²) * 10^6 = Pa. (F/A em N/mm² é o mesmo que MPa)
-df_ensaio["tensao_pa"] = (df_ensaio["forca_n"] / area) * MEGA_TO_SI 
-# Deformação Específica (mm/mm é adimensional, usamos L0 em mm)
-df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM 
+df_ensaio = calcular_tensao_deformacao(df_ensaio, caminho_csv, mtime_ensaio, area)
 
 # ------------------------------------------------------------
 # PREPARAÇÃO DOS SLIDERS E FILTRO
@@ -138,24 +241,17 @@ df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM
 st.sidebar.markdown("---")
 st.sidebar.subheader("📐 Filtro para Módulo de Elasticidade")
 
+# np.unique já devolve os valores ordenados; os padrões (10% e 90%) vêm da lista completa
+slider_eps, slider_tensao = valores_sliders(df_ensaio, caminho_csv, mtime_ensaio, area)
+all_eps_values, (default_min_eps, default_max_eps) = slider_eps
+all_tensao_pa_values, (default_min_tensao_pa, default_max_tensao_pa) = slider_tensao
+
 ### 1. Slider para Deformação Específica (X)
-all_eps_values = df_ensaio["deformacao_especifica"].round(6).unique()
-all_eps_values.sort()
 
 if all_eps_values.size < 2:
     st.error("Não há dados de deformação suficientes para a regressão.")
     st.stop()
 
-# Valores padrão
-default_min_idx_eps = 0
-default_max_idx_eps = len(all_eps_values) - 1
-if len(all_eps_values) > 10: 
-    default_min_idx_eps = int(len(all_eps_values) * 0.10)
-    default_max_idx_eps = int(len(all_eps_values) * 0.90)
-
-default_min_eps = all_eps_values[default_min_idx_eps]
-default_max_eps = all_eps_values[default_max_idx_eps]
-
 limites_filtro_eps = st.sidebar.select_slider(
     '1. Limite X (Deformação Específica $\\varepsilon$):',
     options=all_eps_values,
@@ -167,23 +263,11 @@ eps_min_filtro, eps_max_filtro = limites_filtro_eps
 
 ### 2. Slider para Tensão (Y)
 # Usando tensão em Pa no slider
-all_tensao_pa_values = df_ensaio["tensao_pa"].round(0).unique() 
-all_tensao_pa_values.sort()
 
 if all_tensao_pa_values.size < 2:
     st.error("Não há dados de tensão suficientes para a regressão.")
     st.stop()
 
-# Valores padrão (em Pa)
-default_min_idx_tensao = 0
-default_max_idx_tensao = len(all_tensao_pa_values) - 1
-if len(all_tensao_pa_values) > 10: 
-    default_min_idx_tensao = int(len(all_tensao_pa_values) * 0.10)
-    default_max_idx_tensao = int(len(all_tensao_pa_values) * 0.90)
-
-default_min_tensao_pa = all_tensao_pa_values[default_min_idx_tensao]
-default_max_tensao_pa = all_tensao_pa_values[default_max_idx_tensao]
-
 limites_filtro_tensao = st.sidebar.select_slider(
     '2. Limite Y (Tensão $\\sigma$):',
     options=all_tensao_pa_values,
@@ -193,34 +277,23 @@ limites_filtro_tensao = st.sidebar.select_slider(
 tensao_min_filtro_pa, tensao_max_filtro_pa = limites_filtro_tensao
 
 
-### 3. Aplica o Filtro Combinado (Usando a coluna tensao_pa)
-df_filtrado = df_ensaio[
-    (df_ensaio["deformacao_especifica"] >= eps_min_filtro) & 
-    (df_ensaio["deformacao_especifica"] <= eps_max_filtro) &
-    (df_ensaio["tensao_pa"] >= tensao_min_filtro_pa) & 
-    (df_ensaio["tensao_pa"] <= tensao_max_filtro_pa)
-].copy()
+### 3. Aplica o Filtro Combinado e calcula a regressão (em cache por CP e limites:
+###    reruns que não mudam os sliders, como zoom no gráfico, não refazem o cálculo)
+indices_filtrados, E_modulo, intercept, r_squared, erro_regressao = filtrar_e_ajustar(
+    df_ensaio, caminho_csv, mtime_ensaio, area,
+    eps_min_filtro, eps_max_filtro, tensao_min_filtro_pa, tensao_max_filtro_pa
+)
+df_filtrado = df_ensaio.iloc[indices_filtrados]
 
 
 # ------------------------------------------------------------
 # CÁLCULO DO MÓDULO DE ELASTICIDADE (E) E R² (E agora está em Pa)
 # ------------------------------------------------------------
-E_modulo = np.nan
-r_squared = np.nan
-intercept = np.nan
 regressao_info = "Selecione um intervalo válido com dados suficientes para regressão."
-
-if len(df_filtrado) > 1:
-    try:
-        # A regressão usa Deformação (adimensional) e Tensão (Pa) -> E_modulo sai em Pa
-        slope, intercept, r_value, p_value, std_err = stats.linregress(
-            df_filtrado["deformacao_especifica"], df_filtrado["tensao_pa"]
-        )
-        E_modulo = slope # E_modulo agora está em Pa
-        r_squared = r_value**2
-        regressao_info = f"\\sigma\\text{{(Pa)}} = {E_modulo:,.2e} \\cdot \\varepsilon + {intercept:,.2e}"
-    except ValueError:
-        regressao_info = "Erro ao calcular regressão: dados inválidos no intervalo."
+if erro_regressao:
+    regressao_info = "Erro ao calcular regressão: dados inválidos no intervalo."
+elif not np.isnan(E_modulo):
+    regressao_info = f"\\sigma\\text{{(Pa)}} = {E_modulo:,.2e} \\cdot \\varepsilon + {intercept:,.2e}"
         
 # ------------------------------------------------------------
 # EXIBIÇÃO DOS RESULTADOS NA SIDEBAR
@@ -246,19 +319,19 @@ st.markdown("---")
 st.markdown("### 📄 Informações do Corpo de Prova Selecionado (Unidades SI)")
 
 # Conversão das dimensões para SI
+# Formatando para exibição em notação científica com 5 casas, removendo a unidade da string.
+def formatar_si(valor):
+    return f"{valor:,.5e}" if not pd.isna(valor) else "N/A"
+
 cp_dados_si = {
     "CP": [cp_info["cp"]],
     "Nome": [cp_info["nome"]],
-    "Largura (m)": [cp_info["largura"] * MM_TO_SI],
-    "Espessura (m)": [cp_info["espessura"] * MM_TO_SI],
-    "Área (m²)": [cp_info["area"] * MM2_TO_SI],
+    "Largura (m)": [formatar_si(cp_info["largura"] * MM_TO_SI)],
+    "Espessura (m)": [formatar_si(cp_info["espessura"] * MM_TO_SI)],
+    "Área (m²)": [formatar_si(cp_info["area"] * MM2_TO_SI)],
 }
 df_cp_si = pd.DataFrame(cp_dados_si)
 
-# Formatando para exibição em notação científica com 5 casas, removendo a unidade da string.
-for col in ["Largura (m)", "Espessura (m)", "Área (m²)"]:
-    df_cp_si[col] = df_cp_si[col].apply(lambda x: f"{x:,.5e}" if not pd.isna(x) else "N/A")
-
 st.dataframe(df_cp_si, use_container_width=True, hide_index=True)
 
 # L0 em metros
@@ -272,10 +345,15 @@ st.markdown("---")
 # ------------------------------------------------------------
 # PLOTAGEM DOS TRÊS GRÁFICOS (VERTICAL)
 # ------------------------------------------------------------
+# As curvas completas são desenhadas com no máximo MAX_PONTOS_GRAFICO pontos
+# (amostragem a passo fixo) e em WebGL; os cálculos usam sempre todos os dados.
+passo_grafico = max(1, int(np.ceil(len(df_ensaio) / MAX_PONTOS_GRAFICO)))
+df_grafico = df_ensaio.iloc[::passo_grafico]
+
 # --- Gráfico 1: TENSÃO x TEMPO ---
 st.subheader("1. Tensão ($\sigma$) x Tempo (t)")
 # Tensão em Pa
-fig_tensao = px.line(df_ensaio, x="tempo_s", y="tensao_pa", title="Tensão (Pa) Aplicada ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "tensao_pa": "Tensão (Pa)"})
+fig_tensao = px.line(df_grafico, x="tempo_s", y="tensao_pa", title="Tensão (Pa) Aplicada ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "tensao_pa": "Tensão (Pa)"}, render_mode="webgl")
 fig_tensao.add_hline(y=0, line_dash="dash", line_color="gray")
 fig_tensao.update_traces(line=dict(width=2))
 fig_tensao.update_layout(template="plotly_white")
@@ -284,7 +362,7 @@ st.markdown("---")
 
 # --- Gráfico 2: DEFORMAÇÃO x TEMPO ---
 st.subheader("2. Deformação ($\Delta L$) x Tempo (t)")
-fig_deformacao = px.line(df_ensaio, x="tempo_s", y="deformacao_mm", title="Deformação (mm) ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "deformacao_mm": "Deformação ($\Delta L$) (mm)"})
+fig_deformacao = px.line(df_grafico, x="tempo_s", y="deformacao_mm", title="Deformação (mm) ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "deformacao_mm": "Deformação ($\Delta L$) (mm)"}, render_mode="webgl")
 fig_deformacao.add_hline(y=0, line_dash="dash", line_color="gray")
 fig_deformacao.update_traces(line=dict(width=2))
 fig_deformacao.update_layout(template="plotly_white")
@@ -299,16 +377,16 @@ st.caption(f"Ajuste os limites $\\varepsilon$ e $\sigma$ na barra lateral. O Mó
 fig_tensao_deformacao = go.Figure()
 
 # 1. Curva Completa (Linha)
-fig_tensao_deformacao.add_trace(go.Scatter(
-    x=df_ensaio["deformacao_especifica"],
-    y=df_ensaio["tensao_pa"], # Usando Pa
+fig_tensao_deformacao.add_trace(go.Scattergl(
+    x=df_grafico["deformacao_especifica"],
+    y=df_grafico["tensao_pa"], # Usando Pa
     mode='lines',
     line=dict(color='gray', width=1.5),
     name='Curva Completa (Ordem Temporal)'
 ))
 
 # 2. Pontos Filtrados (Scatter)
-fig_tensao_deformacao.add_trace(go.Scatter(
+fig_tensao_deformacao.add_trace(go.Scattergl(
     x=df_filtrado["deformacao_especifica"],
     y=df_filtrado["tensao_pa"], # Usando Pa
     mode='markers',
@@ -408,14 +486,8 @@ if not np.isnan(E_modulo):
 else:
     st.warning("⚠️ O Módulo de Elasticidade não pôde ser calculado. Selecione um intervalo válido.")
 
-# 2. Exportação dos Dados Completos
-# Alterando o nome da coluna de tensão no CSV completo para refletir Pa
-df_export_completo = df_ensaio[["tempo_s", "deformacao_mm", "forca_n", "tensao_pa", "deformacao_especifica"]].copy()
-df_export_completo = df_export_completo.rename(columns={"tensao_pa": "tensao_pa"})
-
-csv_export = df_export_completo.to_csv(
-    index=False, sep=';', decimal=',', encoding='latin-1'
-).encode('latin-1')
+# 2. Exportação dos Dados Completos (tensão em Pa)
+csv_export = gerar_csv_completo(df_ensaio, caminho_csv, mtime_ensaio, area)
 
 # Botão para download dos Dados Completos
 st.download_button(
@@ -3,8 +3,10 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import re
 import numpy as np
-from scipy import stats
+
+from comum import regressao_linear, lttb, PONTOS_LTTB, ler_ensaio
 
 # Constantes de conversão
 MEGA_TO_SI = 1e6 # 1 MPa = 10^6 Pa
@@ -32,19 +34,28 @@ COLUNAS_GERAL = [
     "cp", "nome", "largura", "espessura", 
     "ret_ext", "area", "forca_max", "tensao_max", "energia"
 ]
+PADRAO_NUM_CP = re.compile(r"\d+") # Número do CP dentro do nome (ex.: "CP 12" -> "12")
 
 # ------------------------------------------------------------
-# CARREGAR ARQUIVO GERAL (Para obter as dimensões)
+# FUNÇÕES DE CARREGAMENTO (em cache; a data de modificação do arquivo entra na
+# chave, de modo que editar o CSV invalida o cache)
 # ------------------------------------------------------------
-try:
+def numero_cp(nome_cp):
+    # Primeiro número do nome do CP, como texto ("nan" se não houver)
+    encontrado = PADRAO_NUM_CP.search(str(nome_cp))
+    return encontrado.group() if encontrado else "nan"
+
+@st.cache_data(show_spinner=False)
+def carregar_geral(caminho, mtime):
     geral = pd.read_csv(
-        "geral.csv", 
+        caminho, 
         sep=";", 
         decimal=",", 
         encoding_errors="ignore",
         header=None,       
         skiprows=1, # Corrigido para pular apenas a primeira linha
-        names=COLUNAS_GERAL 
+        names=COLUNAS_GERAL,
+        dtype={"cp": str, "nome": str}
     )
     
     # GARANTINDO O TIPO NUMÉRICO
@@ -53,7 +64,90 @@ try:
     geral["espessura"] = pd.to_numeric(geral["espessura"], errors='coerce')
     
     # Extrai o número do CP para auxiliar na filtragem/ordenacao
-    geral["cp_num"] = geral["cp"].str.extract(r"(\d+)").astype(str)
+    geral["cp_num"] = [numero_cp(nome) for nome in geral["cp"].to_numpy()]
+    return geral
+
+@st.cache_data(show_spinner=False)
+def carregar_ensaio_pagina(caminho, mtime):
+    df_ensaio = ler_ensaio(caminho)
+    return df_ensaio.dropna(subset=["tempo_s", "deformacao_mm", "forca_n"]).sort_values(by="tempo_s").reset_index(drop=True)
+
+# ------------------------------------------------------------
+# GRÁFICOS (em cache por CP: tudo o que é desenhado é determinado pelo arquivo
+# do ensaio, sua data de modificação e a área; os argumentos com prefixo "_"
+# não entram no hash)
+# ------------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def grafico_tensao_tempo(_df_ensaio, caminho, mtime, area):
+    fig_tensao = px.line(_df_ensaio, x="tempo_s", y="tensao_pa", title="Tensão (Pa) Aplicada ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "tensao_pa": "Tensão (Pa)"})
+    fig_tensao.add_hline(y=0, line_dash="dash", line_color="gray")
+    fig_tensao.update_traces(line=dict(width=2))
+    fig_tensao.update_layout(template="plotly_white")
+    return fig_tensao
+
+@st.cache_data(show_spinner=False)
+def grafico_tensao_deformacao(_df_ensaio, _eps_filtrado, _tensao_filtrada, _E_modulo, _intercept, _r_squared,
+                              _sigma_inferior_pa, _sigma_superior_pa, caminho, mtime, area):
+    fig_tensao_deformacao = go.Figure()
+
+    # 1. Curva Completa (Linha), reduzida para o navegador (a regressão usa todos os pontos)
+    eps_curva = _df_ensaio["deformacao_especifica"].to_numpy()
+    tensao_curva = _df_ensaio["tensao_pa"].to_numpy()
+    idx_curva = lttb(eps_curva, tensao_curva, PONTOS_LTTB)
+    fig_tensao_deformacao.add_trace(go.Scatter(
+        x=eps_curva[idx_curva],
+        y=tensao_curva[idx_curva],
+        mode='lines',
+        line=dict(color='gray', width=1.5),
+        name='Curva Completa'
+    ))
+
+    # 2. Pontos Filtrados (Scatter)
+    fig_tensao_deformacao.add_trace(go.Scatter(
+        x=_eps_filtrado,
+        y=_tensao_filtrada,
+        mode='markers',
+        marker=dict(size=5, color='blue'),
+        name=f'Pontos Filtrados (10% a 40%)'
+    ))
+
+    # 3. Adiciona a Trendline CALCULADA MANUALMENTE
+    if not np.isnan(_E_modulo):
+        # Usamos os limites de tensão para encontrar os limites de deformação para plotar a reta
+        x_line = np.array([_eps_filtrado.min(), _eps_filtrado.max()])
+        y_line = _E_modulo * x_line + _intercept
+
+        fig_tensao_deformacao.add_trace(go.Scatter(
+            x=x_line,
+            y=y_line,
+            mode='lines',
+            line=dict(color='red', width=3, dash='dash'),
+            name=f'Regressão Linear (E = {_E_modulo:,.2e} Pa, R² = {_r_squared:,.4f})'
+        ))
+
+    # Adiciona linhas de referência para os limites (NOVO)
+    fig_tensao_deformacao.add_hline(y=_sigma_inferior_pa, line_dash="dot", line_color="green", name="10% $\sigma_{máx}$", annotation_text="10% $\sigma_{máx}$")
+    fig_tensao_deformacao.add_hline(y=_sigma_superior_pa, line_dash="dot", line_color="orange", name="40% $\sigma_{máx}$", annotation_text="40% $\sigma_{máx}$")
+
+    # Configurações do Layout
+    fig_tensao_deformacao.update_layout(
+        title="Curva Tensão x Deformação Específica",
+        xaxis_title="Deformação Específica - (mm/mm)",
+        yaxis_title="Tensão (Pa)", 
+        template="plotly_white",
+        hovermode="x unified"
+    )
+
+    # Adiciona linhas no zero
+    fig_tensao_deformacao.add_hline(y=0, line_dash="dash", line_color="gray")
+    fig_tensao_deformacao.add_vline(x=0, line_dash="dash", line_color="gray")
+    return fig_tensao_deformacao
+
+# ------------------------------------------------------------
+# CARREGAR ARQUIVO GERAL (Para obter as dimensões)
+# ------------------------------------------------------------
+try:
+    geral = carregar_geral("geral.csv", os.path.getmtime("geral.csv"))
 except FileNotFoundError:
     st.error("❌ Arquivo 'geral.csv' não encontrado no diretório do projeto.")
     st.stop()
@@ -103,12 +197,8 @@ if not os.path.exists(caminho_csv):
     st.stop()
 
 try:
-    df_ensaio = pd.read_csv(caminho_csv, sep=";", decimal=",", encoding_errors="ignore")
-    df_ensaio.columns = ["tempo_s", "deformacao_mm", "forca_n"]
-    df_ensaio["tempo_s"] = pd.to_numeric(df_ensaio["tempo_s"], errors="coerce")
-    df_ensaio["deformacao_mm"] = pd.to_numeric(df_ensaio["deformacao_mm"], errors="coerce")
-    df_ensaio["forca_n"] = pd.to_numeric(df_ensaio["forca_n"], errors="coerce")
-    df_ensaio = df_ensaio.dropna(subset=["tempo_s", "deformacao_mm", "forca_n"]).sort_values(by="tempo_s").reset_index(drop=True)
+    mtime_ensaio = os.path.getmtime(caminho_csv)
+    df_ensaio = carregar_ensaio_pagina(caminho_csv, mtime_ensaio)
     
 except Exception as e:
     st.error(f"Erro ao ler ou processar o arquivo {caminho_csv}: {e}")
@@ -125,10 +215,11 @@ if area <= 0 or pd.isna(area):
       st.error(f"❌ Área do CP {cp_selecionado} inválida ou zero ({area} mm²).")
       st.stop()
 
-# Tensão (N/mm²) * 10^6 = Pa.
-df_ensaio["tensao_pa"] = (df_ensaio["forca_n"] / area) * MEGA_TO_SI 
+# Tensão (N/mm²) * 10^6 = Pa. Os fatores escalares são combinados antes, para
+# uma única multiplicação sobre cada coluna.
+df_ensaio["tensao_pa"] = df_ensaio["forca_n"].to_numpy() * (MEGA_TO_SI / area)
 # Deformação Específica (mm/mm)
-df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM 
+df_ensaio["deformacao_especifica"] = df_ensaio["deformacao_mm"].to_numpy() * (-1.0 / L0_MM)
 
 # ------------------------------------------------------------
 # CÁLCULO E FILTRAGEM BASEADOS NA NORMA (NOVA LÓGICA)
@@ -145,11 +236,11 @@ if tensao_max_pa <= 0:
 sigma_inferior_pa = PERCENTUAL_MIN_MODULO * tensao_max_pa
 sigma_superior_pa = PERCENTUAL_MAX_MODULO * tensao_max_pa
 
-# 3. Filtrar os Dados
-df_filtrado = df_ensaio[
-    (df_ensaio["tensao_pa"] >= sigma_inferior_pa) & 
-    (df_ensaio["tensao_pa"] <= sigma_superior_pa)
-].copy()
+# 3. Filtrar os Dados (só as duas colunas usadas, como arrays NumPy)
+tensao_pa = df_ensaio["tensao_pa"].to_numpy(dtype=np.float64)
+mascara_norma = (tensao_pa >= sigma_inferior_pa) & (tensao_pa <= sigma_superior_pa)
+eps_filtrado = df_ensaio["deformacao_especifica"].to_numpy(dtype=np.float64)[mascara_norma]
+tensao_filtrada = tensao_pa[mascara_norma]
 
 # ------------------------------------------------------------
 # CÁLCULO DO MÓDULO DE ELASTICIDADE (E) E R²
@@ -159,14 +250,10 @@ r_squared = np.nan
 intercept = np.nan
 regressao_info = "Não foi possível calcular. Intervalo de tensão (10%-40%) não contém dados."
 
-if len(df_filtrado) >= 2:
+if eps_filtrado.size >= 2:
     try:
         # A regressão usa Deformação (adimensional) e Tensão (Pa) -> E_modulo sai em Pa
-        slope, intercept, r_value, p_value, std_err = stats.linregress(
-            df_filtrado["deformacao_especifica"], df_filtrado["tensao_pa"]
-        )
-        E_modulo = slope # E_modulo agora está em Pa
-        r_squared = r_value**2
+        E_modulo, intercept, r_squared = regressao_linear(eps_filtrado, tensao_filtrada)
         
         # Apenas para mostrar a equação no Streamlit
         regressao_info = f"\\sigma\\text{{(Pa)}} = ({E_modulo:,.2e}) \\cdot \\varepsilon + ({intercept:,.2e})"
@@ -200,7 +287,7 @@ st.sidebar.markdown("---")
 st.sidebar.caption(f"Filtro Automático Aplicado:")
 st.sidebar.write(f"$\sigma$ Inferior (10%): **{sigma_inferior_pa:,.2e} Pa**")
 st.sidebar.write(f"$\sigma$ Superior (40%): **{sigma_superior_pa:,.2e} Pa**")
-st.sidebar.write(f"Pontos Filtrados: **{len(df_filtrado)}**")
+st.sidebar.write(f"Pontos Filtrados: **{eps_filtrado.size}**")
 
 st.markdown("---")
 
@@ -237,74 +324,24 @@ st.sidebar.metric(
 # ------------------------------------------------------------
 # --- Gráfico 1: TENSÃO x TEMPO ---
 # (Manteremos os gráficos de tempo para referência, apesar de não serem mais usados para filtro)
-fig_tensao = px.line(df_ensaio, x="tempo_s", y="tensao_pa", title="Tensão (Pa) Aplicada ao Longo do Tempo", labels={"tempo_s": "Tempo (s)", "tensao_pa": "Tensão (Pa)"})
-fig_tensao.add_hline(y=0, line_dash="dash", line_color="gray")
-fig_tensao.update_traces(line=dict(width=2))
-fig_tensao.update_layout(template="plotly_white")
-st.plotly_chart(fig_tensao, use_container_width=True)
+# Só é montado e enviado ao navegador quando o usuário pede
+if st.checkbox("Mostrar gráfico Tensão x Tempo", value=False):
+    fig_tensao = grafico_tensao_tempo(df_ensaio, caminho_csv, mtime_ensaio, area)
+    st.plotly_chart(fig_tensao, use_container_width=True)
 st.markdown("---") 
 
 # --- Gráfico 3: TENSÃO x DEFORMAÇÃO ESPECÍFICA (COM FILTRO DA NORMA) ---
 st.subheader("2. Tensão ($\sigma$) x Deformação Específica ($\\varepsilon$)")
 st.caption(f"Regressão na região de 10% a 40% da Tensão Máxima.")
 
-fig_tensao_deformacao = go.Figure()
-
-# 1. Curva Completa (Linha)
-fig_tensao_deformacao.add_trace(go.Scatter(
-    x=df_ensaio["deformacao_especifica"],
-    y=df_ensaio["tensao_pa"],
-    mode='lines',
-    line=dict(color='gray', width=1.5),
-    name='Curva Completa'
-))
-
-# 2. Pontos Filtrados (Scatter)
-fig_tensao_deformacao.add_trace(go.Scatter(
-    x=df_filtrado["deformacao_especifica"],
-    y=df_filtrado["tensao_pa"],
-    mode='markers',
-    marker=dict(size=5, color='blue'),
-    name=f'Pontos Filtrados (10% a 40%)'
-))
-
-# 3. Adiciona a Trendline CALCULADA MANUALMENTE
 if not np.isnan(E_modulo):
-    # Usamos os limites de tensão para encontrar os limites de deformação para plotar a reta
-    eps_min_plot = df_filtrado["deformacao_especifica"].min()
-    eps_max_plot = df_filtrado["deformacao_especifica"].max()
-    
-    x_line = np.array([eps_min_plot, eps_max_plot])
-    y_line = E_modulo * x_line + intercept
-
-    fig_tensao_deformacao.add_trace(go.Scatter(
-        x=x_line,
-        y=y_line,
-        mode='lines',
-        line=dict(color='red', width=3, dash='dash'),
-        name=f'Regressão Linear (E = {E_modulo:,.2e} Pa, R² = {r_squared:,.4f})'
-    ))
-    
     st.info(f"Fórmula da Regressão na Região Filtrada: ${regressao_info}$")
 
-# Adiciona linhas de referência para os limites (NOVO)
-fig_tensao_deformacao.add_hline(y=sigma_inferior_pa, line_dash="dot", line_color="green", name="10% $\sigma_{máx}$", annotation_text="10% $\sigma_{máx}$")
-fig_tensao_deformacao.add_hline(y=sigma_superior_pa, line_dash="dot", line_color="orange", name="40% $\sigma_{máx}$", annotation_text="40% $\sigma_{máx}$")
-
-
-# Configurações do Layout
-fig_tensao_deformacao.update_layout(
-    title="Curva Tensão x Deformação Específica",
-    xaxis_title="Deformação Específica - (mm/mm)",
-    yaxis_title="Tensão (Pa)", 
-    template="plotly_white",
-    hovermode="x unified"
+fig_tensao_deformacao = grafico_tensao_deformacao(
+    df_ensaio, eps_filtrado, tensao_filtrada, E_modulo, intercept, r_squared,
+    sigma_inferior_pa, sigma_superior_pa, caminho_csv, mtime_ensaio, area
 )
 
-# Adiciona linhas no zero
-fig_tensao_deformacao.add_hline(y=0, line_dash="dash", line_color="gray")
-fig_tensao_deformacao.add_vline(x=0, line_dash="dash", line_color="gray")
-
 st.plotly_chart(
     fig_tensao_deformacao, 
     use_container_width=True,
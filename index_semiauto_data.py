@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 import os
+import re
 import glob
 import sys
+from multiprocessing import Pool
+
+from comum import regressao_linear, carregar_ensaio
 
 # --- CONSTANTES GLOBAIS ---
 # Constantes de conversão
@@ -17,19 +20,33 @@ PERCENTUAL_MAX_MODULO = 0.40 # 40% da tensão máxima
 
 # Configurações de Arquivos
 PASTA_ENSAIOS = "ensaios" 
+PASTA_CACHE_ENSAIOS = os.path.join(PASTA_ENSAIOS, ".cache") # Ensaios já lidos, em Parquet
 ARQUIVO_GERAL = "geral.csv"
 ARQUIVO_SAIDA = "resultados_norma_batch.csv"
 COLUNAS_GERAL = [
     "cp", "nome", "largura", "espessura", 
     "ret_ext", "area", "forca_max", "tensao_max", "energia"
 ]
+PADRAO_NUM_CP = re.compile(r"\d+") # Número do CP dentro do nome (ex.: "CP 12" -> 12)
+
+# Registro de saída (uma linha por CP processado): (nome da coluna no CSV, tipo)
+TIPO_RESULTADO = np.dtype([
+    ("CP", object),
+    ("Módulo de Elasticidade (E) [Pa]", np.float64),
+    ("Coeficiente de Determinação (R2)", np.float64),
+    ("Intercepto da Regressão (b) [Pa]", np.float64),
+    ("Tensão Máxima (sigma_max) [Pa]", np.float64),
+    ("Limite Inferior Tensão (sigma_min) [Pa]", np.float64),
+    ("Limite Superior Tensão (sigma_sup) [Pa]", np.float64),
+])
 
 # --- FUNÇÃO PRINCIPAL DE PROCESSAMENTO ---
 
 def processar_cp(cp_nome, area_mm2):
     """
     Processa os dados de um único CP, calcula o Módulo de Elasticidade (E) 
-    usando a regra da norma (10%-40% da tensão máxima) e retorna os resultados.
+    usando a regra da norma (10%-40% da tensão máxima) e retorna os resultados
+    como uma tupla no formato de TIPO_RESULTADO (ou None, se o CP for inválido).
     """
     cp_num = cp_nome.split()[-1]
     caminho_csv = os.path.join(PASTA_ENSAIOS, f"{cp_num}.csv")
@@ -40,13 +57,8 @@ def processar_cp(cp_nome, area_mm2):
         return None
 
     try:
-        # 1. Carregar Dados do Ensaio
-        df_ensaio = pd.read_csv(caminho_csv, sep=";", decimal=",", encoding_errors="ignore")
-        df_ensaio.columns = ["tempo_s", "deformacao_mm", "forca_n"]
-        # Garante que os dados são numéricos
-        df_ensaio["deformacao_mm"] = pd.to_numeric(df_ensaio["deformacao_mm"], errors="coerce")
-        df_ensaio["forca_n"] = pd.to_numeric(df_ensaio["forca_n"], errors="coerce")
-        df_ensaio = df_ensaio.dropna(subset=["deformacao_mm", "forca_n"]).reset_index(drop=True)
+        # 1. Carregar Dados do Ensaio (garantindo que os dados são numéricos)
+        df_ensaio = carregar_ensaio(caminho_csv, PASTA_CACHE_ENSAIOS).reset_index(drop=True)
 
     except Exception as e:
         print(f"❌ Erro ao ler ou processar o arquivo {caminho_csv}: {e}")
@@ -57,9 +69,10 @@ def processar_cp(cp_nome, area_mm2):
 
     # 2. Cálculos de Tensão (Pa) e Deformação Específica
     # Tensão (N/mm²) * 10^6 = Pa. (F/A em N/mm² é o mesmo que MPa)
-    df_ensaio["tensao_pa"] = (df_ensaio["forca_n"] / area_mm2) * MEGA_TO_SI 
+    # Os fatores escalares são combinados antes: uma única multiplicação por coluna.
+    df_ensaio["tensao_pa"] = df_ensaio["forca_n"].to_numpy() * (MEGA_TO_SI / area_mm2)
     # Deformação Específica (mm/mm é adimensional)
-    df_ensaio["deformacao_especifica"] = -df_ensaio["deformacao_mm"] / L0_MM 
+    df_ensaio["deformacao_especifica"] = df_ensaio["deformacao_mm"].to_numpy() * (-1.0 / L0_MM)
     
     # 3. Determinar Limites da Norma
     tensao_max_pa = df_ensaio["tensao_pa"].max()
@@ -71,42 +84,50 @@ def processar_cp(cp_nome, area_mm2):
     sigma_inferior_pa = PERCENTUAL_MIN_MODULO * tensao_max_pa
     sigma_superior_pa = PERCENTUAL_MAX_MODULO * tensao_max_pa
     
-    # 4. Filtrar Dados
-    df_filtrado = df_ensaio[
-        (df_ensaio["tensao_pa"] >= sigma_inferior_pa) & 
-        (df_ensaio["tensao_pa"] <= sigma_superior_pa)
-    ].copy()
+    # 4. Filtrar Dados (só as duas colunas usadas, como arrays NumPy)
+    tensao_pa = df_ensaio["tensao_pa"].to_numpy(dtype=np.float64)
+    mascara_norma = (tensao_pa >= sigma_inferior_pa) & (tensao_pa <= sigma_superior_pa)
+    eps_filtrado = df_ensaio["deformacao_especifica"].to_numpy(dtype=np.float64)[mascara_norma]
+    tensao_filtrada = tensao_pa[mascara_norma]
 
-    if len(df_filtrado) < 2:
+    if eps_filtrado.size < 2:
         print(f"⚠️ Aviso: CP {cp_nome} tem dados insuficientes no intervalo de 10%-40%.")
         return None
 
     # 5. Regressão Linear
     try:
-        slope, intercept, r_value, p_value, std_err = stats.linregress(
-            df_filtrado["deformacao_especifica"], df_filtrado["tensao_pa"]
-        )
-        E_modulo = slope 
-        r_squared = r_value**2
+        E_modulo, intercept, r_squared = regressao_linear(eps_filtrado, tensao_filtrada)
 
     except ValueError:
         print(f"❌ Erro de Valor: Não foi possível calcular a regressão para o CP {cp_nome}.")
         return None
 
-    # 6. Retorno dos Resultados
-    return {
-        "CP": cp_nome,
-        "Módulo de Elasticidade (E) [Pa]": E_modulo,
-        "Coeficiente de Determinação (R2)": r_squared,
-        "Intercepto da Regressão (b) [Pa]": intercept,
-        "Tensão Máxima (sigma_max) [Pa]": tensao_max_pa,
-        "Limite Inferior Tensão (sigma_min) [Pa]": sigma_inferior_pa,
-        "Limite Superior Tensão (sigma_max) [Pa]": sigma_superior_pa,
-    }
+    # 6. Retorno dos Resultados (na ordem das colunas de TIPO_RESULTADO)
+    return (
+        cp_nome,
+        E_modulo,
+        r_squared,
+        intercept,
+        tensao_max_pa,
+        sigma_inferior_pa,
+        sigma_superior_pa,
+    )
 
 
 # --- EXECUÇÃO DO BATCH ---
 
+def numero_cp(nome_cp):
+    # Primeiro número do nome do CP (NaN se não houver) para ordenar os CPs
+    encontrado = PADRAO_NUM_CP.search(str(nome_cp))
+    return int(encontrado.group()) if encontrado else np.nan
+
+def _processar_cp_tarefa(tarefa):
+    # Adaptador de nível de módulo (serializável) para o Pool
+    cp_nome, area = tarefa
+    print(f"-> Processando {cp_nome}...")
+    return processar_cp(cp_nome, area)
+
+
 def main():
     print(f"Iniciando processamento em lote...")
 
@@ -123,7 +144,8 @@ def main():
             encoding_errors="ignore",
             header=None,       
             skiprows=1, # Assume que a primeira linha é o cabeçalho/metadado
-            names=COLUNAS_GERAL 
+            names=COLUNAS_GERAL,
+            dtype={"cp": str, "nome": str}
         )
         # Conversão de tipo necessária para filtragem
         geral["area"] = pd.to_numeric(geral["area"], errors='coerce')
@@ -139,33 +161,29 @@ def main():
         sys.exit(1)
 
     # Ordenação (Apenas para garantir a ordem da saída)
-    cp_validos["cp_num"] = cp_validos["cp"].str.extract(r"(\d+)").astype(int, errors='ignore')
+    cp_validos["cp_num"] = [numero_cp(nome) for nome in cp_validos["cp"].to_numpy()]
     cp_validos = cp_validos.sort_values(by="cp_num").reset_index(drop=True)
     
     print(f"Total de CPs válidos a processar: {len(cp_validos)}")
     
-    # 3. Processar em Loop
-    resultados_list = []
+    # 3. Processar em paralelo (cada CP é independente dos demais)
+    #    imap preserva a ordem dos CPs na saída
+    tarefas = list(zip(cp_validos["cp"].to_numpy(), cp_validos["area"].to_numpy(dtype=np.float64)))
+    resultados = np.empty(len(tarefas), dtype=TIPO_RESULTADO)
+    n_sucesso = 0
     
-    for index, row in cp_validos.iterrows():
-        cp_nome = row["cp"]
-        area = row["area"]
-        
-        print(f"-> Processando {cp_nome}...")
-        resultado = processar_cp(cp_nome, area)
-        
-        if resultado:
-            resultados_list.append(resultado)
+    with Pool(processes=os.cpu_count()) as pool:
+        for resultado in pool.imap(_processar_cp_tarefa, tarefas, chunksize=4):
+            if resultado:
+                resultados[n_sucesso] = resultado
+                n_sucesso += 1
 
     # 4. Consolidar e Exportar
-    if not resultados_list:
+    if n_sucesso == 0:
         print("\nProcessamento concluído. 😔 Nenhum CP foi processado com sucesso.")
         return
 
-    df_final = pd.DataFrame(resultados_list)
-
-    # Ajuste o nome da coluna de limite superior para corresponder ao formato solicitado
-    df_final = df_final.rename(columns={"Limite Superior Tensão (sigma_max) [Pa]": "Limite Superior Tensão (sigma_sup) [Pa]"})
+    df_final = pd.DataFrame(resultados[:n_sucesso])
     
     # Formato do CSV (ponto como decimal, notação científica com 5 casas)
     df_final.to_csv(
@@ -8,13 +8,12 @@ output_folder = "ensaios_modulo_3_pontos"      # Pasta onde os CSVs serão salvo
 # Cria a pasta de saída se não existir
 os.makedirs(output_folder, exist_ok=True)
 
-# Lê o Excel
-xls = pd.ExcelFile(xlsx_file)
-print(f"Abas encontradas: {xls.sheet_names}")
+# Lê todas as abas do Excel de uma vez (o arquivo é aberto e descompactado uma só vez)
+abas = pd.read_excel(xlsx_file, sheet_name=None)
+print(f"Abas encontradas: {list(abas)}")
 
 # Converte cada aba para CSV
-for aba in xls.sheet_names:
-    df = pd.read_excel(xlsx_file, sheet_name=aba)
+for aba, df in abas.items():
     # Substitui caracteres inválidos no nome do arquivo
     nome_csv = "".join([c if c.isalnum() or c in "_-" else "_" for c in aba])
     csv_path = os.path.join(output_folder, f"{nome_csv}.csv")
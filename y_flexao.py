@@ -2,8 +2,10 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from scipy import stats
-from io import StringIO
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from comum import lttb, PONTOS_LTTB
 
 # --- CONFIGURAÇÃO ---
 st.set_page_config(page_title="Módulo de Flexão (E₀) - Comparativo", layout="wide")
@@ -33,78 +35,95 @@ L = st.sidebar.number_input("Vão (L) [mm]", value=1200.0)
 h = st.sidebar.number_input("Altura (h) [mm]", value=100.0)
 b = st.sidebar.number_input("Largura (b) [mm]", value=50.0)
 
+# Fator geométrico da fórmula de E₀ (depende só da geometria e do tipo de ensaio, então
+# é calculado uma vez para todos os arquivos): E₀ [Pa] = fator_E0 * ΔF/Δe [kN/mm]
+L_SI, h_SI, b_SI = L/1000, h/1000, b/1000
+if tipo_ensaio == "3 Pontos":
+    fator_E0 = (1/4) * ((L_SI/b_SI)**3) * (1/h_SI) * 1e6  # kN/mm -> N/m
+else:
+    fator_E0 = (23/108) * ((L_SI/h_SI)**3) * (1/b_SI) * 1e6
+
 # --- INTERVALOS ---
 st.sidebar.markdown("---")
 faixa = st.sidebar.slider("Faixa inicial (% da Fmáx)", 0, 100, (10, 40))
 deform_min, deform_max = st.sidebar.slider("Limite de deformação (mm)", 0.0, 200.0, (0.0, 200.0), 0.1)
 
 # --- FUNÇÃO DE LEITURA ---
-@st.cache_data
-def carregar_dados(uploaded_file, header_row=50):
-    try:
-        string_data = StringIO(uploaded_file.getvalue().decode("utf-8", errors="ignore"))
-        df = pd.read_csv(string_data, sep=",", header=None, decimal=".")
-        df = df.dropna(how="all")
-        df = df.iloc[header_row:, :].reset_index(drop=True)
-        df = df.iloc[:, [1, 2]].copy()
-        df.columns = ["Forca_kN", "Deformacao_mm"]
-        df = df.apply(pd.to_numeric, errors="coerce").dropna()
-        return df
-    except Exception as e:
-        st.error(f"Erro ao ler {uploaded_file.name}: {e}")
-        return pd.DataFrame()
+# Em cache pelo conteúdo do arquivo (bytes): mudar sliders ou geometria não relê o CSV.
+# Roda nas threads de processamento: não chama o Streamlit (nem o spinner do cache),
+# o erro sobe para quem chamou.
+# Retorna (força em kN, deformação em mm) como arrays float64, sem linhas inválidas
+@st.cache_data(show_spinner=False, max_entries=64)
+def carregar_dados(conteudo, header_row=50):
+    # O parser C lê os bytes diretamente, sem decodificar o arquivo inteiro em str.
+    # O cabeçalho conta linhas não vazias em todas as colunas, por isso o arquivo é lido
+    # inteiro; as duas colunas usadas são recortadas e convertidas de uma vez.
+    df = pd.read_csv(BytesIO(conteudo), sep=",", header=None, decimal=".", engine="c",
+                     encoding="utf-8", encoding_errors="ignore")
+    dados = df.dropna(how="all").iloc[header_row:, [1, 2]]
+    forca = pd.to_numeric(dados.iloc[:, 0], errors="coerce").to_numpy(dtype=np.float64)
+    deformacao = pd.to_numeric(dados.iloc[:, 1], errors="coerce").to_numpy(dtype=np.float64)
+    validos = ~(np.isnan(forca) | np.isnan(deformacao))
+    return forca[validos], deformacao[validos]
 
 # --- FUNÇÃO PARA BUSCAR MELHOR INTERVALO ---
-def buscar_intervalo_otimo(df, Fmin, Flim, deform_min, deform_max, r2_min=0.95, reducao_passo=0.1):
-    df_faixa = df[(df["Forca_kN"] >= Fmin) & (df["Forca_kN"] <= Flim) &
-                  (df["Deformacao_mm"] >= deform_min) & (df["Deformacao_mm"] <= deform_max)].copy()
-    if len(df_faixa) < 5:
+def buscar_intervalo_otimo(forca, deform, Fmin, Flim, deform_min, deform_max, r2_min=0.95, reducao_passo=0.1):
+    # Filtro e sub-intervalos direto sobre os arrays de força e deformação
+    mascara = (forca >= Fmin) & (forca <= Flim) & (deform >= deform_min) & (deform <= deform_max)
+    x, y = deform[mascara], forca[mascara]
+
+    n_pontos = x.size
+    if n_pontos < 5:
         return None, None, None, None, False
 
-    n_pontos = len(df_faixa)
-    melhor_r2 = -np.inf
-    melhor_slope, melhor_intercept = None, None
-    melhor_df = df_faixa.copy()
-    automatico = False
-
-    for frac in np.arange(1.0, 0.4, -reducao_passo):
-        n_sub = max(3, int(n_pontos * frac))
-        sub_df = df_faixa.iloc[:n_sub]
-        slope, intercept, r_value, _, _ = stats.linregress(sub_df["Deformacao_mm"], sub_df["Forca_kN"])
-        r2 = r_value**2
-        if r2 > melhor_r2:
-            melhor_r2 = r2
-            melhor_slope, melhor_intercept = slope, intercept
-            melhor_df = sub_df.copy()
-        if r2 >= r2_min:
-            automatico = True
-            break
-
-    return melhor_slope, melhor_intercept, melhor_df, melhor_r2, automatico
+    # Candidatos: os primeiros 100%, 90%, ... (acima de 40%) dos pontos da faixa, todos
+    # avaliados de uma vez a partir de somas acumuladas dos dados centralizados na média
+    # (cada candidato custa O(1)). Candidatos degenerados (variância nula) valem R² = 0.
+    # Os tamanhos saem de percentuais inteiros, sem a deriva de um arange com passo float
+    percentuais = np.arange(100, 40, -round(reducao_passo * 100))
+    tamanhos = np.maximum(3, n_pontos * percentuais // 100)
+    x_media, y_media = x.mean(), y.mean()
+    xc, yc = x - x_media, y - y_media
+    k = tamanhos - 1
+    Sx, Sy = np.cumsum(xc)[k], np.cumsum(yc)[k]
+    Sxx, Syy, Sxy = np.cumsum(xc * xc)[k], np.cumsum(yc * yc)[k], np.cumsum(xc * yc)[k]
+
+    var_x = tamanhos * Sxx - Sx * Sx
+    var_y = tamanhos * Syy - Sy * Sy
+    cov_xy = tamanhos * Sxy - Sx * Sy
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = cov_xy / var_x
+        r2s = cov_xy * cov_xy / (var_x * var_y)
+    r2s = np.where(np.isfinite(r2s), r2s, 0.0)
+
+    # O primeiro candidato com R² ≥ r2_min (ajuste automático); senão, o de maior R²
+    atingiram = np.flatnonzero(r2s >= r2_min)
+    automatico = atingiram.size > 0
+    i = atingiram[0] if automatico else int(np.argmax(r2s))
+
+    melhor_n, melhor_slope, melhor_r2 = tamanhos[i], slopes[i], r2s[i]
+    melhor_intercept = y_media + (Sy[i] - melhor_slope * Sx[i]) / melhor_n - melhor_slope * x_media
+
+    # Pontos usados no ajuste: (deformação, força)
+    return melhor_slope, melhor_intercept, (x[:melhor_n], y[:melhor_n]), melhor_r2, automatico
 
 # --- FUNÇÃO DE PROCESSAMENTO ---
-def processar_ensaio(nome_arquivo, df, L, h, b, faixa, tipo_ensaio, deform_min, deform_max):
-    if df.empty:
-        return None, df, df, None, None, None, None, None
+def processar_ensaio(nome_arquivo, forca, deform, fator_E0, faixa, tipo_ensaio, deform_min, deform_max):
+    curva = (deform, forca)
+    if forca.size == 0:
+        return None, curva, curva, None, None, None, None, None
 
-    Fmax = df["Forca_kN"].max()
+    Fmax = forca.max()
     Fmin = (faixa[0] / 100) * Fmax
     Flim = (faixa[1] / 100) * Fmax
 
-    slope, intercept, df_reg, r2, automatico = buscar_intervalo_otimo(df, Fmin, Flim, deform_min, deform_max)
-
-    if df_reg is None or slope is None:
-        return None, df, df, None, None, Fmin, Flim, None
+    slope, intercept, pontos_reg, r2, automatico = buscar_intervalo_otimo(forca, deform, Fmin, Flim, deform_min, deform_max)
 
-    delta_F_delta_e_SI = slope * 1e6
-    L_SI, h_SI, b_SI = L/1000, h/1000, b/1000
+    if pontos_reg is None or slope is None:
+        return None, curva, curva, None, None, Fmin, Flim, None
 
-    if tipo_ensaio == "3 Pontos":
-        E0_pa = (1/4) * ((L_SI/b_SI)**3) * delta_F_delta_e_SI * (1/h_SI)
-    else:
-        E0_pa = (23/108) * ((L_SI/h_SI)**3) * delta_F_delta_e_SI * (1/b_SI)
-
-    E0_gpa = E0_pa / 1e9
+    E0_gpa = fator_E0 * slope / 1e9
 
     return {
         "Ensaio": nome_arquivo,
@@ -114,20 +133,90 @@ def processar_ensaio(nome_arquivo, df, L, h, b, faixa, tipo_ensaio, deform_min,
         "R²": r2,
         "E₀ (GPa)": E0_gpa,
         "Ajuste": "Automático" if automatico else "Manual"
-    }, df, df_reg, slope, intercept, Fmin, Flim, automatico
+    }, curva, pontos_reg, slope, intercept, Fmin, Flim, automatico
+
+# --- GRÁFICO ---
+# Em cache por ensaio: tudo o que é desenhado é determinado pelo upload (file_id), pela
+# faixa e pelos limites de deformação; mudar a geometria ou outro widget não remonta o
+# gráfico. Os argumentos com prefixo "_" não entram no hash
+@st.cache_data(show_spinner=False, max_entries=32)
+def montar_figura(_x_all, _y_all, _x_reg, _y_reg, _slope, _intercept, _Fmin, _Flim,
+                  id_arquivo, faixa, deform_min, deform_max):
+    # A figura é montada de uma só vez (traços, linhas de referência e anotações):
+    # cada add_trace / add_hline revalidaria a figura inteira a cada rerun
+
+    # Curva completa, reduzida para o navegador (o ajuste usa todos os pontos)
+    idx_curva = lttb(_x_all, _y_all, PONTOS_LTTB)
+    tracos = [
+        go.Scattergl(
+            x=_x_all[idx_curva], y=_y_all[idx_curva],
+            mode='lines', name='Curva completa',
+            line=dict(color='lightgray', width=1.5)
+        ),
+        # Pontos usados na regressão
+        go.Scattergl(
+            x=_x_reg, y=_y_reg,
+            mode='markers', name='Usado na regressão',
+            marker=dict(size=6, color='blue')
+        ),
+    ]
+
+    # Linha de regressão
+    if _slope is not None:
+        # Uma reta só precisa dos dois extremos
+        x_fit = np.array([_x_reg.min(), _x_reg.max()])
+        tracos.append(go.Scatter(
+            x=x_fit, y=_slope * x_fit + _intercept,
+            mode='lines', name='Regressão Linear',
+            line=dict(color='red', width=3, dash='dash')
+        ))
+
+    # Limites da faixa de força (linhas horizontais de ponta a ponta, rótulo à direita)
+    formas, anotacoes = [], []
+    for F, cor, pct in [(_Fmin, "green", faixa[0]), (_Flim, "orange", faixa[1])]:
+        formas.append(dict(type="line", xref="x domain", x0=0, x1=1, yref="y", y0=F, y1=F,
+                           line=dict(color=cor, dash="dot")))
+        anotacoes.append(dict(text=f"{pct}% Fmáx", showarrow=False, xref="x domain", x=1,
+                              xanchor="right", yref="y", y=F, yanchor="bottom"))
+
+    return go.Figure(data=tracos, layout=go.Layout(
+        shapes=formas,
+        annotations=anotacoes,
+        xaxis_title="Deformação (mm)",
+        yaxis_title="Força (kN)",
+        template="plotly_white",
+        hovermode="x unified",
+        height=550
+    ))
 
 # --- LOOP DE PROCESSAMENTO ---
+# Cada arquivo é independente: leitura e ajuste rodam em threads (o parser C do pandas
+# libera o GIL). Os bytes dos uploads são lidos antes e as mensagens de erro exibidas
+# depois, ambos na thread do script.
+def processar_arquivo(nome, conteudo):
+    try:
+        (forca, deform), erro = carregar_dados(conteudo), None
+    except Exception as e:
+        forca = deform = np.empty(0)
+        erro = f"Erro ao ler {nome}: {e}"
+    return erro, processar_ensaio(nome, forca, deform, fator_E0, faixa, tipo_ensaio, deform_min, deform_max)
+
+nomes = [f.name for f in uploaded_files]
+ids = [f.file_id for f in uploaded_files]
+conteudos = [f.getvalue() for f in uploaded_files]
+
+with ThreadPoolExecutor(max_workers=min(8, len(uploaded_files))) as executor:
+    processados = list(executor.map(processar_arquivo, nomes, conteudos))
+
 resultados, dados_abas = [], {}
 
-for f in uploaded_files:
-    df = carregar_dados(f)
-    nome = f.name
-    resultado, df_all, df_reg, slope, intercept, Fmin, Flim, automatico = processar_ensaio(
-        nome, df, L, h, b, faixa, tipo_ensaio, deform_min, deform_max
-    )
+for nome, id_arquivo, (erro, processado) in zip(nomes, ids, processados):
+    if erro:
+        st.error(erro)
+    resultado, curva, pontos_reg, slope, intercept, Fmin, Flim, automatico = processado
     if resultado:
         resultados.append(resultado)
-        dados_abas[nome] = (df_all, df_reg, slope, intercept, Fmin, Flim)
+        dados_abas[nome] = (id_arquivo, curva, pontos_reg, slope, intercept, Fmin, Flim)
     else:
         resultados.append({"Ensaio": nome, "E₀ (GPa)": None})
 
@@ -145,43 +234,10 @@ ensaios_validos = df_result[df_result["E₀ (GPa)"].notna()]["Ensaio"]
 
 if not ensaios_validos.empty:
     escolha = st.selectbox("🔍 Escolha o ensaio:", ensaios_validos)
-    df_all, df_reg, slope, intercept, Fmin, Flim = dados_abas[escolha]
-
-    fig = go.Figure()
+    id_arquivo, (x_all, y_all), (x_reg, y_reg), slope, intercept, Fmin, Flim = dados_abas[escolha]
 
-    # Curva completa
-    fig.add_trace(go.Scatter(
-        x=df_all["Deformacao_mm"], y=df_all["Forca_kN"],
-        mode='lines', name='Curva completa',
-        line=dict(color='lightgray', width=1.5)
-    ))
-
-    # Pontos usados na regressão
-    fig.add_trace(go.Scatter(
-        x=df_reg["Deformacao_mm"], y=df_reg["Forca_kN"],
-        mode='markers', name='Usado na regressão',
-        marker=dict(size=6, color='blue')
-    ))
-
-    # Linha de regressão
-    if slope is not None:
-        x_fit = np.linspace(df_reg["Deformacao_mm"].min(), df_reg["Deformacao_mm"].max(), 50)
-        fig.add_trace(go.Scatter(
-            x=x_fit, y=slope * x_fit + intercept,
-            mode='lines', name='Regressão Linear',
-            line=dict(color='red', width=3, dash='dash')
-        ))
-
-    fig.add_hline(y=Fmin, line_color="green", line_dash="dot", annotation_text=f"{faixa[0]}% Fmáx")
-    fig.add_hline(y=Flim, line_color="orange", line_dash="dot", annotation_text=f"{faixa[1]}% Fmáx")
-
-    fig.update_layout(
-        xaxis_title="Deformação (mm)",
-        yaxis_title="Força (kN)",
-        template="plotly_white",
-        hovermode="x unified",
-        height=550
-    )
+    fig = montar_figura(x_all, y_all, x_reg, y_reg, slope, intercept, Fmin, Flim,
+                        id_arquivo, faixa, deform_min, deform_max)
     st.plotly_chart(fig, use_container_width=True)
 else:
     st.warning("Nenhum ensaio válido encontrado.")
@@ -2,7 +2,9 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from scipy.stats import linregress
+from concurrent.futures import ThreadPoolExecutor
+
+from comum import regressao_linear, lttb, PONTOS_LTTB, ler_ensaio
 
 st.set_page_config(page_title="Analisador de Tração", layout="wide")
 
@@ -21,39 +23,63 @@ if not uploaded_files:
     st.stop()
 
 # --- Leitura dos arquivos ---
-dados = []
-for file in uploaded_files:
+# Em cache pelo conteúdo do arquivo (bytes): mexer nos sliders ou trocar o arquivo
+# selecionado não relê os CSVs. Leitura comum aos ensaios (pyarrow, se disponível;
+# senão, o parser C direto em float64, com células inválidas como NaN), em latin1.
+# Roda nas threads de leitura: não chama o Streamlit (nem o spinner do cache)
+@st.cache_data(show_spinner=False, max_entries=64)
+def carregar_arquivo(conteudo):
+    df = ler_ensaio(conteudo, encoding="latin1")
+    df["deformacao_mm"] = -df["deformacao_mm"]  # inverte o sinal
+    return df
+
+# Os arquivos são lidos em paralelo (o parser C do pandas libera o GIL); os bytes são
+# obtidos antes e os avisos exibidos depois, na thread do script
+def ler_arquivo(conteudo):
     try:
-        df = pd.read_csv(
-            file,
-            sep=";",
-            decimal=",",
-            header=None,
-            skiprows=1,
-            usecols=[0, 1, 2],
-            names=["tempo_s", "deformacao_mm", "forca_n"],
-            encoding="latin1"
-        )
-        df["deformacao_mm"] = -df["deformacao_mm"]  # inverte o sinal
-        df["arquivo"] = file.name
-        dados.append(df)
+        return carregar_arquivo(conteudo), None
     except Exception as e:
-        st.warning(f"Erro ao ler '{file.name}': {e}")
+        return None, e
+
+conteudos = [file.getvalue() for file in uploaded_files]
+with ThreadPoolExecutor(max_workers=min(8, len(uploaded_files))) as executor:
+    lidos = list(executor.map(ler_arquivo, conteudos))
+
+dados, nomes_dados, dados_por_arquivo, ids_por_arquivo = [], [], {}, {}
+for file, (df, erro) in zip(uploaded_files, lidos):
+    if erro is not None:
+        st.warning(f"Erro ao ler '{file.name}': {erro}")
+        continue
+    dados.append(df)
+    nomes_dados.append(file.name)
+    dados_por_arquivo.setdefault(file.name, []).append(df)
+    ids_por_arquivo.setdefault(file.name, []).append(file.file_id)
 
 if not dados:
     st.error("Nenhum arquivo pôde ser lido.")
     st.stop()
 
 # --- Compilação ---
+# O nome do arquivo entra como categoria: um código por linha em vez de uma string
 df_compilado = pd.concat(dados, ignore_index=True)
+codigos, categorias = pd.factorize(np.array(nomes_dados, dtype=object))
+df_compilado["arquivo"] = pd.Categorical.from_codes(
+    np.repeat(codigos, [len(df) for df in dados]), categories=categorias
+)
 
 # --- Seleção do arquivo ---
-arquivos = df_compilado["arquivo"].unique()
+# Os dados do arquivo escolhido vêm direto do dicionário, sem varrer o compilado
+arquivos = [nome for nome, dfs in dados_por_arquivo.items() if any(len(df) for df in dfs)]
 arquivo_sel = st.selectbox("Escolha o arquivo para visualizar:", arquivos)
-df_sel = df_compilado[df_compilado["arquivo"] == arquivo_sel].copy()
+dfs_sel = dados_por_arquivo[arquivo_sel]
+df_sel = dfs_sel[0] if len(dfs_sel) == 1 else pd.concat(dfs_sel, ignore_index=True)
+
+# Colunas usadas nos cálculos e no gráfico, como arrays NumPy (NaN = célula inválida)
+forca = df_sel["forca_n"].to_numpy(dtype=np.float64)
+deformacao = df_sel["deformacao_mm"].to_numpy(dtype=np.float64)
 
 # --- Cálculo da força máxima ---
-fmax = df_sel["forca_n"].max()
+fmax = np.nanmax(forca)
 
 # --- Sliders ---
 st.sidebar.header("🔧 Filtros de regressão")
@@ -66,7 +92,7 @@ y_perc_lim = st.sidebar.slider(
 fmin_y, fmax_y = [p / 100 * fmax for p in y_perc_lim]
 
 # Deformação (mm)
-x_min, x_max = df_sel["deformacao_mm"].min(), df_sel["deformacao_mm"].max()
+x_min, x_max = np.nanmin(deformacao), np.nanmax(deformacao)
 x_lim = st.sidebar.slider(
     "Intervalo de deformação (mm)",
     float(x_min), float(x_max),
@@ -75,18 +101,13 @@ x_lim = st.sidebar.slider(
 )
 
 # --- Filtra os pontos usados na regressão ---
-df_reg = df_sel[
-    (df_sel["forca_n"] >= fmin_y)
-    & (df_sel["forca_n"] <= fmax_y)
-    & (df_sel["deformacao_mm"] >= x_lim[0])
-    & (df_sel["deformacao_mm"] <= x_lim[1])
-]
+mascara_reg = (forca >= fmin_y) & (forca <= fmax_y) & (deformacao >= x_lim[0]) & (deformacao <= x_lim[1])
+x_reg, y_reg = deformacao[mascara_reg], forca[mascara_reg]
 
 # --- Regressão linear ---
-if len(df_reg) >= 2:
-    slope, intercept, r_value, _, _ = linregress(df_reg["deformacao_mm"], df_reg["forca_n"])
+if x_reg.size >= 2:
+    slope, intercept, r2 = regressao_linear(x_reg, y_reg)
     rigidez = slope
-    r2 = r_value**2
 else:
     slope = intercept = rigidez = r2 = np.nan
 
@@ -114,84 +135,88 @@ st.dataframe(df_resultados.style.format({
 }), use_container_width=True)
 
 # --- Gráfico principal ---
-fig = go.Figure()
-
-# Curva completa
-fig.add_trace(go.Scatter(
-    x=df_sel["deformacao_mm"],
-    y=df_sel["forca_n"],
-    mode="lines",
-    name="Curva completa",
-    line=dict(color="royalblue")
-))
-
-# Pontos da regressão
-fig.add_trace(go.Scatter(
-    x=df_reg["deformacao_mm"],
-    y=df_reg["forca_n"],
-    mode="markers",
-    name="Pontos da regressão",
-    marker=dict(color="orange", size=6)
-))
-
-# Reta da regressão
-if not np.isnan(slope):
-    x_fit = np.linspace(df_reg["deformacao_mm"].min(), df_reg["deformacao_mm"].max(), 100)
-    y_fit = slope * x_fit + intercept
-    fig.add_trace(go.Scatter(
-        x=x_fit,
-        y=y_fit,
-        mode="lines",
-        name=f"Regressão Linear (R²={r2:.4f})",
-        line=dict(color="red", dash="dot")
+# Em cache por arquivo: tudo o que é desenhado é determinado pelos uploads escolhidos
+# (file_id) e pelos filtros; outras interações não remontam o gráfico. Os argumentos
+# com prefixo "_" não entram no hash
+@st.cache_data(show_spinner=False, max_entries=32)
+def montar_figura(_deformacao, _forca, _x_reg, _y_reg, _slope, _intercept, _r2, _fmin_y, _fmax_y,
+                  ids_arquivo, arquivo_sel, y_perc_lim, x_lim):
+    # A figura é montada de uma só vez (traços, formas e anotações): cada add_trace /
+    # add_hline / add_shape revalidaria a figura inteira a cada rerun
+
+    # Curva completa, reduzida para o navegador (a regressão usa todos os pontos).
+    # Pontos com NaN ficam de fora da redução (estragariam os baldes do LTTB); os
+    # índices voltam a ser os do arquivo
+    finitos = np.flatnonzero(np.isfinite(_deformacao) & np.isfinite(_forca))
+    idx_curva = finitos[lttb(_deformacao[finitos], _forca[finitos], PONTOS_LTTB)]
+    tracos = [
+        go.Scattergl(
+            x=_deformacao[idx_curva],
+            y=_forca[idx_curva],
+            mode="lines",
+            name="Curva completa",
+            line=dict(color="royalblue")
+        ),
+        # Pontos da regressão
+        go.Scattergl(
+            x=_x_reg,
+            y=_y_reg,
+            mode="markers",
+            name="Pontos da regressão",
+            marker=dict(color="orange", size=6)
+        ),
+    ]
+
+    # Reta da regressão
+    if not np.isnan(_slope):
+        x_fit = np.linspace(_x_reg.min(), _x_reg.max(), 100)
+        y_fit = _slope * x_fit + _intercept
+        tracos.append(go.Scatter(
+            x=x_fit,
+            y=y_fit,
+            mode="lines",
+            name=f"Regressão Linear (R²={_r2:.4f})",
+            line=dict(color="red", dash="dot")
+        ))
+
+    # Linhas de referência e área sombreada
+    # (horizontais: limites de força; verticais: limites de deformação)
+    formas = [
+        dict(type="line", xref="x domain", x0=0, x1=1, yref="y", y0=_fmin_y, y1=_fmin_y,
+             line=dict(color="green", dash="dash")),
+        dict(type="line", xref="x domain", x0=0, x1=1, yref="y", y0=_fmax_y, y1=_fmax_y,
+             line=dict(color="red", dash="dash")),
+        dict(type="line", xref="x", x0=x_lim[0], x1=x_lim[0], yref="y domain", y0=0, y1=1,
+             line=dict(color="gray", dash="dot")),
+        dict(type="line", xref="x", x0=x_lim[1], x1=x_lim[1], yref="y domain", y0=0, y1=1,
+             line=dict(color="gray", dash="dot")),
+        # Área sombreada verde translúcida
+        dict(type="rect", x0=x_lim[0], x1=x_lim[1], y0=_fmin_y, y1=_fmax_y,
+             fillcolor="rgba(0, 200, 0, 0.3)", line=dict(width=0), layer="below"),
+    ]
+    anotacoes = [
+        dict(text=f"{y_perc_lim[0]:.0f}% Fmáx ({_fmin_y:.1f} N)", showarrow=False,
+             xref="x domain", x=0, xanchor="left", yref="y", y=_fmin_y, yanchor="bottom"),
+        dict(text=f"{y_perc_lim[1]:.0f}% Fmáx ({_fmax_y:.1f} N)", showarrow=False,
+             xref="x domain", x=0, xanchor="left", yref="y", y=_fmax_y, yanchor="top"),
+        dict(text=f"{x_lim[0]:.3f} mm", showarrow=False,
+             xref="x", x=x_lim[0], xanchor="left", yref="y domain", y=1, yanchor="top"),
+        dict(text=f"{x_lim[1]:.3f} mm", showarrow=False,
+             xref="x", x=x_lim[1], xanchor="right", yref="y domain", y=1, yanchor="top"),
+    ]
+
+    return go.Figure(data=tracos, layout=go.Layout(
+        shapes=formas,
+        annotations=anotacoes,
+        title=f"Força × Deformação ({arquivo_sel})",
+        xaxis_title="Deformação (mm)",
+        yaxis_title="Força (N)",
+        template="plotly_white",
+        height=600
     ))
 
-# --- Linhas de referência e área sombreada ---
-fig.add_hline(
-    y=fmin_y,
-    line=dict(color="green", dash="dash"),
-    annotation_text=f"{y_perc_lim[0]:.0f}% Fmáx ({fmin_y:.1f} N)",
-    annotation_position="top left"
-)
-fig.add_hline(
-    y=fmax_y,
-    line=dict(color="red", dash="dash"),
-    annotation_text=f"{y_perc_lim[1]:.0f}% Fmáx ({fmax_y:.1f} N)",
-    annotation_position="bottom left"
-)
-fig.add_vline(
-    x=x_lim[0],
-    line=dict(color="gray", dash="dot"),
-    annotation_text=f"{x_lim[0]:.3f} mm",
-    annotation_position="top right"
-)
-fig.add_vline(
-    x=x_lim[1],
-    line=dict(color="gray", dash="dot"),
-    annotation_text=f"{x_lim[1]:.3f} mm",
-    annotation_position="top left"
-)
-
-# --- Área sombreada verde translúcida ---
-fig.add_shape(
-    type="rect",
-    x0=x_lim[0],
-    x1=x_lim[1],
-    y0=fmin_y,
-    y1=fmax_y,
-    fillcolor="rgba(0, 200, 0, 0.3)",
-    line=dict(width=0),
-    layer="below"
-)
-
-fig.update_layout(
-    title=f"Força × Deformação ({arquivo_sel})",
-    xaxis_title="Deformação (mm)",
-    yaxis_title="Força (N)",
-    template="plotly_white",
-    height=600
-)
-
+fig = montar_figura(deformacao, forca, x_reg, y_reg, slope, intercept, r2, fmin_y, fmax_y,
+                    tuple(ids_por_arquivo[arquivo_sel]), arquivo_sel, y_perc_lim, x_lim)
 st.plotly_chart(fig, use_container_width=True)
 
 # --- Dados compilados ---